@@ -2,17 +2,108 @@
 # and delete policy documents while managing their embeddings in the knowledge base.
 
 import streamlit as st
+import hashlib
+import json
 import os
-from embedding_manager import EmbeddingManager
+from answer_cache import get_answer_cache
+from config import KNOWLEDGE_BASE_PATH
+from embedding_manager import get_shared_manager
+from ingest_jobs import get_job_queue, DONE, FAILED
+from knowledge_sync import plan_sync, sync_report
+from page_cache import get_page_cache
+from telemetry import get_metrics, recent_traces, snapshot, REQUEST_METRIC
 
 # Directory to store uploaded PDFs
-UPLOAD_FOLDER = "knowledge_base"
+UPLOAD_FOLDER = KNOWLEDGE_BASE_PATH
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 def get_manager():
-    if "manager" not in st.session_state:
-        st.session_state.manager = EmbeddingManager()
-    return st.session_state.manager
+    # Shared by all sessions in this process (one model + one Chroma client)
+    return get_shared_manager()
+
+def save_upload(uploaded_file):
+    """Write the upload to the knowledge base; returns (file path, content hash)"""
+    data = uploaded_file.getbuffer()
+    content_hash = hashlib.sha256(data).hexdigest()
+    file_path = os.path.join(UPLOAD_FOLDER, uploaded_file.name)
+    with open(file_path, "wb") as f:
+        f.write(data)
+    return file_path, content_hash
+
+@st.fragment(run_every=2)
+def ingestion_jobs_panel():
+    """Live view of background ingestion jobs (refreshes itself every 2s without rerunning the page)"""
+    jobs = get_job_queue().list_jobs(limit=10)
+    if not jobs:
+        st.caption("No ingestion jobs yet.")
+        return
+
+    for job in jobs:
+        state = job["state"]
+        if state == DONE:
+            report = job["report"] or {}
+            st.write(f"✅ **{job['pdf_name']}** — {report.get('status', 'done')}: "
+                     f"{report.get('chunks_added', 0)} chunks embedded, {report.get('chunks_removed', 0)} removed")
+        elif state == FAILED:
+            st.write(f"❌ **{job['pdf_name']}** — failed: {job['error']}")
+        elif state == "queued":
+            st.write(f"⏳ **{job['pdf_name']}** — queued")
+        else:
+            if state == "extracting":
+                done, total, unit = job["pages_done"], job["pages_total"], "pages"
+            else:
+                done, total, unit = job["chunks_done"], job["chunks_total"], "chunks"
+            st.progress(done / total if total else 0.0,
+                        text=f"⚙️ {job['pdf_name']} — {state} ({done}/{total} {unit})")
+
+@st.fragment(run_every=2)
+def sync_report_panel():
+    """Per-document result of the last sync, filled in as its ingest jobs finish"""
+    last_sync = st.session_state["last_sync"]
+    queue = get_job_queue()
+    jobs = [job for job in (queue.get(job_id) for job_id in last_sync["job_ids"]) if job]
+    report = sync_report(jobs, last_sync["unchanged"], last_sync["removed"])
+    pending = sum(job["state"] not in (DONE, FAILED) for job in jobs)
+    if pending:
+        st.caption(f"⏳ {pending} of {len(jobs)} sync jobs still running")
+    st.json(report["summary"])
+    st.dataframe(report["documents"] + report["removed"])
+
+@st.fragment(run_every=5)
+def performance_panel():
+    """Live latency percentiles, cache hit rates and index size (refreshes itself every 5s)"""
+    manager = get_manager()
+    metrics = get_metrics()
+    requests = metrics.stage_percentiles(REQUEST_METRIC, label="pipeline").get("chat", {})
+    answer_stats = get_answer_cache().stats()
+    query_stats = manager.query_encoder.stats()
+
+    col1, col2, col3, col4, col5 = st.columns(5)
+    col1.metric("Chat requests", requests.get("count", 0))
+    col2.metric("Request p95", f"{requests['p95_ms']:.0f} ms" if requests.get("p95_ms") is not None else "n/a")
+    col3.metric("Answer cache hit rate", f"{answer_stats['hit_rate']:.0%}")
+    col4.metric("Query cache hit rate", f"{query_stats['hit_rate']:.0%}")
+    col5.metric("Indexed chunks", manager.store.count())
+    st.caption(f"{len(manager.registry.sources())} documents indexed · "
+               f"page text cache {get_page_cache().stats()['bytes'] / 2 ** 20:.1f} MB")
+
+    stages = metrics.stage_percentiles()
+    if stages:
+        st.dataframe([{"stage": name, "count": summary["count"], "p50 ms": summary["p50_ms"],
+                       "p95 ms": summary["p95_ms"], "p99 ms": summary["p99_ms"]}
+                      for name, summary in sorted(stages.items())])
+    else:
+        st.caption("No requests traced yet.")
+
+    traces = recent_traces(limit=10)
+    if traces:
+        rows = []
+        for item in traces:
+            slowest = max(item["spans"], key=lambda s: s["duration_ms"], default=None)
+            rows.append({"trace": item["trace_id"], "started": item["started"], "total ms": item["duration_ms"],
+                         "outcome": item["attrs"].get("outcome", "ok"),
+                         "slowest stage": f"{slowest['name']} ({slowest['duration_ms']:.0f} ms)" if slowest else ""})
+        st.dataframe(rows)
 
 def admin_interface():
     # Initialize the embedding manager
@@ -26,18 +117,19 @@ def admin_interface():
 
     uploaded_file = st.file_uploader("Choose a PDF file", type=["pdf"])
     if uploaded_file is not None:
-        file_path = os.path.join(UPLOAD_FOLDER, uploaded_file.name)
-
-        # Save uploaded file locally
-        with open(file_path, "wb") as f:
-            f.write(uploaded_file.getbuffer())
-
-        st.success(f"✅ File '{uploaded_file.name}' uploaded successfully!")
-
-        # Process and embed the uploaded file
-        with st.spinner("Processing and embedding the document..."):
-            manager.add_pdf_to_collection(file_path)
-        st.success("Document added to EchoPal knowledge base!")
+        # The widget keeps the file across reruns: save and enqueue each upload once, so a document deleted while it
+        # is still in the uploader isn't written back and re-indexed on the next interaction
+        handled = st.session_state.setdefault("handled_uploads", {})
+        if uploaded_file.file_id not in handled:
+            file_path, content_hash = save_upload(uploaded_file)
+            # Embed in the background; progress shows under Ingestion Jobs
+            job = get_job_queue().enqueue(file_path, content_hash)
+            handled[uploaded_file.file_id] = job["id"]
+            st.success(f"✅ File '{uploaded_file.name}' uploaded — indexing job {job['id']} is {job['state']}.")
+
+    # --- Background ingestion progress ---
+    st.subheader("⚙️ Ingestion Jobs")
+    ingestion_jobs_panel()
 
     # --- Display Existing Files ---
     st.subheader("📚 Existing Knowledge Base Documents")
@@ -46,10 +138,30 @@ def admin_interface():
     if st.button("🔄 Refresh Document List"):
         st.rerun()  # rerun the script to refresh the file list
 
+    # --- Sync Button: queue a background job for each new or changed file in the knowledge_base folder ---
+    if st.button("🔁 Sync Knowledge Base"):
+        plan = plan_sync(manager, UPLOAD_FOLDER)
+        queue = get_job_queue()
+        jobs = [queue.enqueue(file_path, content_hash) for file_path, content_hash in plan["changed"]]
+        removed = []
+        for source in plan["orphans"]:
+            removed.append(manager.remove_pdf_from_collection(source))
+            queue.forget(source)
+        st.session_state["last_sync"] = {"job_ids": [job["id"] for job in jobs], "removed": removed,
+                                         "unchanged": [manager.unchanged_report(name) for name in plan["unchanged"]]}
+        st.success(f"🔁 Queued {len(jobs)} new or changed documents, {len(plan['unchanged'])} unchanged, "
+                   f"{len(removed)} removed.")
+    if "last_sync" in st.session_state:
+        sync_report_panel()
+
     files = os.listdir(UPLOAD_FOLDER)
     if files:
         for file in files:
-            st.write(f"📘 {file}")
+            entry = manager.registry.get(file)
+            if entry:
+                st.write(f"📘 {file} — {entry['chunk_count']} chunks indexed")
+            else:
+                st.write(f"📘 {file} — not indexed")
     else:
         st.info("No documents found in the knowledge base yet.")
 
@@ -69,7 +181,29 @@ def admin_interface():
             # Remove chunks from vector DB using the new method
             try:
                 manager.remove_pdf_from_collection(delete_choice)
+                get_job_queue().forget(delete_choice)
             except Exception as e:
                 st.error(f"Error removing from vector DB: {e}")
             else:
-                st.success(f"🗑️ '{delete_choice}' removed from vector DB.")
\ No newline at end of file
+                st.success(f"🗑️ '{delete_choice}' removed from vector DB.")
+
+    # --- Performance Section ---
+    st.subheader("📈 Performance")
+    performance_panel()
+    col1, col2 = st.columns(2)
+    col1.download_button("⬇️ Prometheus metrics", get_metrics().prometheus_text(), file_name="echopal_metrics.txt")
+    col2.download_button("⬇️ Metrics + traces (JSON)", json.dumps(snapshot(), indent=2, default=str),
+                         file_name="echopal_metrics.json")
+
+    # --- Answer Cache Section ---
+    st.subheader("⚡ Answer Cache")
+    cache = get_answer_cache()
+    stats = cache.stats()
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Hit rate", f"{stats['hit_rate']:.0%}")
+    col2.metric("Exact / semantic hits", f"{stats['hits_exact']} / {stats['hits_semantic']}")
+    col3.metric("Misses", stats["misses"])
+    col4.metric("Cached answers", stats["entries"])
+    if st.button("🧽 Clear Answer Cache"):
+        cache.clear()
+        st.success("Answer cache cleared.")
\ No newline at end of file
@@ -0,0 +1,154 @@
+# answer_cache.py = semantic answer cache in front of search + generation. A question that matches an earlier one
+# (same normalized text, or a query embedding above a similarity threshold) returns the stored answer and sources
+# without a vector query or an LLM call. Entries expire (LRU + TTL) and are dropped when a cited document changes,
+# including changes made by another process (picked up through the document registry before each lookup).
+
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from config import ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL, ANSWER_CACHE_SIMILARITY
+from embedding_manager import get_shared_manager
+from telemetry import get_metrics
+
+
+def normalize_prompt(prompt):
+    """Case-, whitespace- and trailing-punctuation-insensitive cache key"""
+    return re.sub(r"\s+", " ", prompt).strip().strip("?!. ").lower()
+
+
+class AnswerCache:
+    def __init__(self, max_entries=ANSWER_CACHE_SIZE, ttl_seconds=ANSWER_CACHE_TTL,
+                 similarity_threshold=ANSWER_CACHE_SIMILARITY, refresh=None):
+        self.max_entries = max_entries
+        # Called before every lookup so pending invalidations (e.g. a registry reload) land first
+        self.refresh = refresh
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self._entries = OrderedDict()  # normalized prompt -> entry, least recently used first
+        self._lock = threading.Lock()
+        self._matrix = None            # stacked unit embeddings for the semantic scan, rebuilt lazily
+        self._matrix_keys = []
+        self._counts = {"hits_exact": 0, "hits_semantic": 0, "misses": 0, "invalidated": 0, "evicted": 0}
+
+    def lookup(self, prompt, query_embedding=None):
+        """Return {"answer", "sources", "match", "similarity"} for a cached answer, or None"""
+        key = normalize_prompt(prompt)
+        if self.refresh is not None:
+            self.refresh()
+        with self._lock:
+            self._expire()
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._counts["hits_exact"] += 1
+                return {"answer": entry["answer"], "sources": entry["sources"], "match": "exact", "similarity": 1.0}
+
+            if query_embedding is not None and self._entries:
+                best_key, similarity = self._nearest(query_embedding)
+                if best_key is not None and similarity >= self.similarity_threshold:
+                    entry = self._entries[best_key]
+                    self._entries.move_to_end(best_key)
+                    self._counts["hits_semantic"] += 1
+                    return {"answer": entry["answer"], "sources": entry["sources"],
+                            "match": "semantic", "similarity": similarity}
+
+            self._counts["misses"] += 1
+            return None
+
+    def store(self, prompt, query_embedding, answer, sources):
+        key = normalize_prompt(prompt)
+        embedding = None
+        if query_embedding is not None:
+            embedding = np.asarray(query_embedding, dtype=np.float32)
+            embedding = embedding / (np.linalg.norm(embedding) or 1.0)
+        with self._lock:
+            self._entries[key] = {
+                "answer": answer,
+                "sources": list(sources),
+                "embedding": embedding,
+                "created": time.time(),
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._counts["evicted"] += 1
+            self._matrix = None
+
+    def invalidate_sources(self, sources):
+        """Drop every answer that cites one of `sources` (called when those documents are re-indexed or deleted)"""
+        sources = set(sources)
+        with self._lock:
+            stale = [key for key, entry in self._entries.items() if sources.intersection(entry["sources"])]
+            for key in stale:
+                del self._entries[key]
+            if stale:
+                self._counts["invalidated"] += len(stale)
+                self._matrix = None
+        return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+
+    def stats(self):
+        with self._lock:
+            hits = self._counts["hits_exact"] + self._counts["hits_semantic"]
+            lookups = hits + self._counts["misses"]
+            return {
+                **self._counts,
+                "entries": len(self._entries),
+                "hit_rate": hits / lookups if lookups else 0.0,
+            }
+
+    # --- internals (call with the lock held) ---
+    def _expire(self):
+        cutoff = time.time() - self.ttl_seconds
+        expired = [key for key, entry in self._entries.items() if entry["created"] < cutoff]
+        for key in expired:
+            del self._entries[key]
+        if expired:
+            self._counts["evicted"] += len(expired)
+            self._matrix = None
+
+    def _nearest(self, query_embedding):
+        if self._matrix is None:
+            self._matrix_keys = [key for key, entry in self._entries.items() if entry["embedding"] is not None]
+            self._matrix = (np.stack([self._entries[key]["embedding"] for key in self._matrix_keys])
+                            if self._matrix_keys else np.empty((0, 0), dtype=np.float32))
+        if not self._matrix_keys:
+            return None, 0.0
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        scores = self._matrix @ query
+        best = int(np.argmax(scores))
+        return self._matrix_keys[best], float(scores[best])
+
+
+# --- Process-wide shared cache, invalidated by the shared EmbeddingManager ---
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+
+def get_answer_cache():
+    """Return the process-wide AnswerCache, subscribed to the shared manager's document change events"""
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            manager = get_shared_manager()
+            cache = AnswerCache(refresh=manager.registry.refresh)
+            manager.add_change_listener(cache.invalidate_sources)
+            metrics = get_metrics()
+            metrics.register_gauge("echopal_answer_cache_entries", lambda: cache.stats()["entries"],
+                                   "Answers held in the semantic answer cache")
+            metrics.register_gauge(
+                "echopal_answer_cache_events_total",
+                lambda: [({"event": event}, value) for event, value in cache.stats().items()
+                         if event not in ("entries", "hit_rate")],
+                "Answer cache hits (exact / semantic), misses, invalidations and evictions", kind="counter")
+            _shared_cache = cache
+    return _shared_cache
@@ -0,0 +1,369 @@
+# benchmark.py = offline end-to-end benchmark and retrieval-quality regression check for EchoPal. Builds a synthetic
+# policy PDF corpus (or uses your own PDFs + labelled questions), ingests it into a throwaway vector store, then measures
+# ingest throughput, search latency percentiles, memory, recall@k / MRR and end-to-end time to first token with the
+# offline stub LLM. Results go to JSON so chunkers, encoders and store backends can be compared before rolling them out.
+#
+# Usage:
+#   python benchmark.py --docs 20 --pages 30 --json baseline.json
+#   ECHOPAL_VECTOR_BACKEND=numpy ECHOPAL_EMBEDDING_BACKEND=onnx python benchmark.py --docs 20 --pages 30 --json numpy_onnx.json
+#   python benchmark.py --corpus fixtures/ --questions fixtures/questions.json --json fixtures.json
+#
+# --questions uses the calibrate_retrieval.py format: [{"question": ..., "sources": [...], "expect": ...}, ...]
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from calibrate_retrieval import answers
+from config import (EMBEDDING_BACKEND, EMBEDDING_MODEL, ONNX_VARIANT, VECTOR_BACKEND, VECTOR_DTYPE, CHUNK_MAX_TOKENS,
+                    CHUNK_OVERLAP_TOKENS, RETRIEVAL_CANDIDATES, RERANK_MODEL, INGEST_WORKERS)
+from embedding_manager import EmbeddingManager
+from generation_backend import StubBackend
+from ingest import ingest, resolve_pdf_paths
+from page_cache import PageCache
+from prompt_builder import assemble_prompt
+from response_generator import build_messages
+
+RECALL_AT = (1, 3, 5, 10)
+CONTEXT_K = 4  # chunks echoPal.py retrieves per question
+
+# --- Synthetic corpus: each fact is one sentence, so a labelled question has exactly one answering chunk ---
+UNIT_ADJECTIVES = ["Retail", "Corporate", "Treasury", "Islamic", "Digital", "Wealth", "Card", "Mortgage", "Trade",
+                   "Payments", "Custody", "Insurance", "Leasing", "Remittance", "Microfinance"]
+UNIT_NOUNS = ["Banking", "Operations", "Services", "Lending", "Markets", "Finance", "Solutions", "Assets", "Clearing",
+              "Advisory", "Deposits", "Securities", "Credit", "Onboarding", "Collections"]
+SUBJECTS = ["customer data backups", "privileged access logs", "cloud service contracts", "security incident reports",
+            "encryption keys", "vendor risk assessments", "disaster recovery test results", "audit trails",
+            "penetration test findings", "outsourcing agreements", "firewall rule changes", "user access reviews",
+            "data leakage alerts", "third party certifications", "change requests", "business continuity plans",
+            "customer complaints", "transaction monitoring alerts", "model validation reports", "software licences"]
+ROLES = ["Chief Risk Officer", "Chief Information Security Officer", "Head of Compliance", "Board Risk Committee",
+         "Chief Technology Officer", "Head of Internal Audit", "Data Protection Officer", "Operational Risk Committee"]
+ATTRIBUTES = {
+    "retention": ("{Subject} held by the {unit} division must be retained for {number} {period}.",
+                  "How long must the {unit} division retain {subject}?"),
+    "review": ("The {unit} division shall review its {subject} every {number} months.",
+               "How often does the {unit} division review {subject}?"),
+    "notification": ("The {unit} division shall notify the Bank of {subject} within {number} hours.",
+                     "How quickly must the {unit} division notify the Bank of {subject}?"),
+    "approval": ("{Subject} in the {unit} division require approval by the {role}.",
+                 "Who approves {subject} in the {unit} division?"),
+    "escalation": ("{Subject} raised in the {unit} division are escalated to the {role}.",
+                   "Who handles escalated {subject} in the {unit} division?"),
+}
+FILLER_ACTORS = ["A financial institution", "The board", "Senior management", "The risk management function",
+                 "Each business unit", "The compliance function"]
+FILLER_ACTIONS = ["should establish", "shall maintain", "is expected to document", "should periodically assess",
+                  "must ensure adequate oversight of", "should clearly articulate"]
+FILLER_OBJECTS = ["a sound governance framework", "the technology risk appetite", "its outsourcing arrangements",
+                  "the controls over information assets", "the criteria for cloud adoption",
+                  "accountability for service reliability"]
+FILLER_TAILS = ["in line with the Bank's expectations", "proportionate to the materiality of the risk",
+                "on an ongoing basis", "prior to any material change", "across the service lifecycle",
+                "for the board's approval"]
+
+
+def make_corpus(folder, n_docs, n_pages, facts_per_page=3, fillers_per_page=8, n_questions=200, seed=7):
+    """Write n_docs synthetic policy PDFs into folder; returns labelled questions in calibrate_retrieval format"""
+    rng = random.Random(seed)
+    os.makedirs(folder, exist_ok=True)
+    units = [f"{a} {n}" for a in UNIT_ADJECTIVES for n in UNIT_NOUNS]
+    rng.shuffle(units)
+    questions = []
+    for d in range(n_docs):
+        unit = units[d] if d < len(units) else f"{units[d % len(units)]} {d // len(units) + 1}"
+        pdf_name = f"policy_{d:04d}.pdf"
+        topics = [(s, a) for s in SUBJECTS for a in ATTRIBUTES]
+        rng.shuffle(topics)
+        pages = []
+        for p in range(n_pages):
+            sentences = [rng.choice(FILLER_ACTORS) + " " + rng.choice(FILLER_ACTIONS) + " " + rng.choice(FILLER_OBJECTS)
+                         + " " + rng.choice(FILLER_TAILS) + "." for _ in range(fillers_per_page)]
+            for n in range(facts_per_page):
+                if not topics:
+                    break
+                subject, attribute = topics.pop()
+                fact_template, question_template = ATTRIBUTES[attribute]
+                values = {"unit": unit, "subject": subject, "Subject": subject[0].upper() + subject[1:],
+                          "number": rng.randint(2, 99), "period": rng.choice(["days", "months", "years"]),
+                          "role": rng.choice(ROLES)}
+                fact = fact_template.format(**values)
+                sentences.insert(rng.randint(0, len(sentences)), f"{p + 1}.{n + 1} {fact}")
+                questions.append({"question": question_template.format(**values), "sources": [pdf_name],
+                                  "expect": fact, "page": p + 1})
+            pages.append(f"{unit} Division Policy - page {p + 1}\n" + " ".join(sentences))
+        write_pdf(os.path.join(folder, pdf_name), pages)
+    rng.shuffle(questions)
+    return questions[:n_questions]
+
+
+def write_pdf(path, pages, width=95):
+    """Minimal text-only PDF (Helvetica, wrapped at `width` characters), no extra dependencies"""
+
+    def escape(line):
+        return line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>",
+               f"<< /Type /Pages /Kids [{' '.join(f'{3 + 2 * i} 0 R' for i in range(len(pages)))}] /Count {len(pages)} >>"]
+    font_id = 3 + 2 * len(pages)
+    for i, text in enumerate(pages):
+        lines = []
+        for paragraph in text.split("\n"):
+            line = ""
+            for word in paragraph.split():
+                if line and len(line) + 1 + len(word) > width:
+                    lines.append(line)
+                    line = word
+                else:
+                    line = f"{line} {word}" if line else word
+            lines.append(line)
+        stream = "BT /F1 9 Tf 12 TL 40 800 Td " + " ".join(f"({escape(line)}) Tj T*" for line in lines) + " ET"
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] /Contents {4 + 2 * i} 0 R "
+                       f"/Resources << /Font << /F1 {font_id} 0 R >> >> >>")
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+    objects.append("<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    out, offsets = b"%PDF-1.4\n", []
+    for i, obj in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{i} 0 obj\n{obj}\nendobj\n".encode("latin-1")
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    out += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode("latin-1")
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("latin-1")
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+# --- Measurements ---
+def percentiles(seconds):
+    """Latency summary in milliseconds"""
+    if not seconds:
+        return {}
+    ms = np.asarray(seconds) * 1000
+    return {"p50": round(float(np.percentile(ms, 50)), 2), "p95": round(float(np.percentile(ms, 95)), 2),
+            "p99": round(float(np.percentile(ms, 99)), 2), "mean": round(float(ms.mean()), 2),
+            "max": round(float(ms.max()), 2), "n": len(ms)}
+
+
+def rss_mb():
+    """Current resident memory of this process, or None if it can't be read"""
+    try:
+        import psutil
+        return round(psutil.Process().memory_info().rss / 2 ** 20, 1)
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            return round(int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20, 1)
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / 2 ** 20 if sys.platform == "darwin" else peak / 1024, 1)
+
+
+def folder_mb(folder):
+    total = 0
+    for root, _, names in os.walk(folder):
+        for name in names:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return round(total / 2 ** 20, 2)
+
+
+def run_search(manager, questions, top_k, repeats=1):
+    """Time every question (first pass uncached, later passes hit the query cache) and score recall@k / MRR"""
+    cold, warm, stage_ms = [], [], {}
+    ranks, context_hits = [], 0
+    for example in questions:
+        started = time.perf_counter()
+        retrieval = manager.retrieve(example["question"], top_k=top_k)
+        cold.append(time.perf_counter() - started)
+        for name, ms in retrieval["timings"]["stages_ms"].items():
+            stage_ms.setdefault(name, []).append(ms / 1000)
+
+        hits = retrieval["hits"]
+        rank = next((i for i, hit in enumerate(hits, start=1) if answers(hit, example)), None)
+        ranks.append(rank)
+        # What echoPal.py would actually send to the LLM: relevant hits among the top CONTEXT_K, else the best one
+        context = [hit for hit in hits[:CONTEXT_K] if hit["relevant"]] or hits[:1]
+        context_hits += any(answers(hit, example) for hit in context)
+
+        for _ in range(repeats - 1):
+            started = time.perf_counter()
+            manager.retrieve(example["question"], top_k=top_k)
+            warm.append(time.perf_counter() - started)
+
+    n = len(questions) or 1
+    quality = {f"recall@{k}": round(sum(1 for r in ranks if r and r <= k) / n, 4) for k in RECALL_AT if k <= top_k}
+    quality[f"mrr@{top_k}"] = round(sum(1 / r for r in ranks if r) / n, 4)
+    quality["context_hit_rate"] = round(context_hits / n, 4)
+    quality["questions"] = len(questions)
+    latency = {"cold_ms": percentiles(cold), "warm_ms": percentiles(warm),
+               "stages_ms": {name: percentiles(values) for name, values in stage_ms.items()}}
+    return latency, quality
+
+
+def run_generation(manager, questions, ttft_ms, tokens_per_s):
+    """Retrieve + stream an answer from the offline stub LLM; end-to-end time to first token and to last token"""
+    backend = StubBackend(ttft_ms=ttft_ms, tokens_per_s=tokens_per_s)
+    first_token, total, prompt_tokens = [], [], []
+    for example in questions:
+        started = time.perf_counter()
+        hits = manager.retrieve(example["question"], top_k=CONTEXT_K)["hits"]
+        # Same prompt assembly as echoPal.py: relevant hits (else the best one), packed into the token budget
+        assembled = assemble_prompt(example["question"], [hit for hit in hits if hit["relevant"]] or hits[:1])
+        prompt_tokens.append(assembled["prompt_tokens"])
+        ttft = None
+        for _ in backend.stream(build_messages(assembled["prompt"])):
+            if ttft is None:
+                ttft = time.perf_counter() - started
+        first_token.append(ttft if ttft is not None else time.perf_counter() - started)
+        total.append(time.perf_counter() - started)
+    return {"ttft_ms": percentiles(first_token), "total_ms": percentiles(total),
+            "prompt_tokens": {"mean": round(float(np.mean(prompt_tokens)), 1) if prompt_tokens else None,
+                              "max": max(prompt_tokens, default=None)},
+            "stub": {"ttft_ms": ttft_ms, "tokens_per_s": tokens_per_s}}
+
+
+def settings():
+    """Configuration the results depend on, so result files can be compared side by side"""
+    return {
+        "embedding_backend": EMBEDDING_BACKEND, "embedding_model": EMBEDDING_MODEL, "onnx_variant": ONNX_VARIANT,
+        "vector_backend": VECTOR_BACKEND, "vector_dtype": VECTOR_DTYPE,
+        "chunk_max_tokens": CHUNK_MAX_TOKENS, "chunk_overlap_tokens": CHUNK_OVERLAP_TOKENS,
+        "retrieval_candidates": RETRIEVAL_CANDIDATES, "rerank_model": RERANK_MODEL or None,
+        "python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(),
+    }
+
+
+def run_benchmark(workdir, corpus=None, questions=None, docs=10, pages=20, n_questions=200, top_k=10, repeats=3,
+                  workers=INGEST_WORKERS, generation_questions=50, stub_ttft_ms=0, stub_tokens_per_s=0, seed=7,
+                  encoder=None):
+    """Run every stage in `workdir` (vector store and page cache live there) and return the results dict"""
+    memory = {"start_rss_mb": rss_mb()}
+    if corpus:
+        paths = resolve_pdf_paths([corpus])
+        corpus_info = {"source": corpus, "documents": len(paths)}
+    else:
+        corpus = os.path.join(workdir, "corpus")
+        started = time.perf_counter()
+        questions = make_corpus(corpus, docs, pages, n_questions=n_questions, seed=seed)
+        paths = resolve_pdf_paths([corpus])
+        corpus_info = {"source": "synthetic", "documents": docs, "pages_per_document": pages, "seed": seed,
+                       "generate_s": round(time.perf_counter() - started, 2)}
+    corpus_info["mb"] = folder_mb(corpus)
+
+    # --- Model load + ingest ---
+    started = time.perf_counter()
+    manager = EmbeddingManager(persist_path=os.path.join(workdir, "vector_store"), encoder=encoder)
+    manager.warm_up()
+    load_s = time.perf_counter() - started
+    memory["after_load_rss_mb"] = rss_mb()
+
+    ingest_report = ingest(paths, manager, workers=workers, copy_to=None,
+                           page_cache=PageCache(os.path.join(workdir, "page_cache")))
+    ingest_report.pop("documents")
+    ingest_report["model_load_s"] = round(load_s, 2)
+    memory["after_ingest_rss_mb"] = rss_mb()
+    memory["index_mb"] = folder_mb(os.path.join(workdir, "vector_store"))
+    memory["chunks"] = manager.store.count()
+
+    # --- Search latency + quality ---
+    latency, quality = run_search(manager, questions, top_k, repeats=repeats)
+    memory["after_search_rss_mb"] = rss_mb()
+
+    # --- End to end with the stub LLM ---
+    generation = run_generation(manager, questions[:generation_questions], stub_ttft_ms, stub_tokens_per_s)
+    memory["peak_rss_mb"] = peak_rss_mb()
+
+    return {"settings": settings(), "corpus": corpus_info, "ingest": ingest_report, "search": latency,
+            "quality": quality, "generation": generation, "memory": memory,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+
+def print_results(results):
+    ingest_report, search, quality = results["ingest"], results["search"], results["quality"]
+    stages = ingest_report["stages"]
+    print(f"\n🏁 {results['settings']['embedding_backend']} / {results['settings']['vector_backend']} "
+          f"({results['settings']['vector_dtype']}), {results['corpus']['documents']} documents")
+    print(f"   ingest  : {ingest_report['pages_extracted']} pages at {stages['extract']['pages_per_s']} pages/s, "
+          f"{ingest_report['chunks_embedded']} chunks embedded at {stages['embed']['chunks_per_s']} chunks/s, "
+          f"total {stages['total']['seconds']:.2f}s")
+    for label, key in (("search", "cold_ms"), ("cached", "warm_ms")):
+        if search[key]:
+            print(f"   {label:<8}: p50 {search[key]['p50']} ms | p95 {search[key]['p95']} ms | p99 {search[key]['p99']} ms")
+    print("   quality : " + " | ".join(f"{name} {value}" for name, value in quality.items()))
+    generation = results["generation"]
+    if generation["ttft_ms"]:
+        print(f"   answer  : first token p50 {generation['ttft_ms']['p50']} ms, p95 {generation['ttft_ms']['p95']} ms, "
+              f"prompt ~{generation['prompt_tokens']['mean']} tokens (max {generation['prompt_tokens']['max']})")
+    memory = results["memory"]
+    print(f"   memory  : {memory['after_search_rss_mb']} MB RSS (peak {memory['peak_rss_mb']} MB), "
+          f"index {memory['index_mb']} MB for {memory['chunks']} chunks")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline EchoPal benchmark: ingest, search latency, recall, memory.")
+    parser.add_argument("--corpus", help="folder of PDFs to use instead of the synthetic corpus (needs --questions)")
+    parser.add_argument("--questions", help="labelled questions JSON (calibrate_retrieval.py format)")
+    parser.add_argument("--docs", type=int, default=10, help="synthetic documents")
+    parser.add_argument("--pages", type=int, default=20, help="pages per synthetic document")
+    parser.add_argument("--num-questions", type=int, default=200, help="synthetic questions to ask")
+    parser.add_argument("--top-k", type=int, default=10, help="hits retrieved per question (recall@k up to this)")
+    parser.add_argument("--repeats", type=int, default=3, help="times each question is asked (later ones are cached)")
+    parser.add_argument("--workers", type=int, default=INGEST_WORKERS, help="processes for page extraction")
+    parser.add_argument("--generation-questions", type=int, default=50, help="questions answered by the stub LLM")
+    parser.add_argument("--stub-ttft-ms", type=float, default=0, help="simulated LLM time to first token")
+    parser.add_argument("--stub-tokens-per-s", type=float, default=0, help="simulated LLM decode speed (0 = instant)")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--workdir", help="keep the corpus and index here instead of a temporary folder")
+    parser.add_argument("--json", metavar="PATH", help="write the results as JSON")
+    args = parser.parse_args(argv)
+
+    if args.corpus and not args.questions:
+        parser.error("--corpus needs --questions")
+    questions = None
+    if args.questions:
+        with open(args.questions, "r", encoding="utf-8") as f:
+            questions = json.load(f)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="echopal_bench_")
+    if args.workdir and os.path.exists(os.path.join(workdir, "vector_store")):
+        parser.error(f"{workdir} already holds an index; pick an empty --workdir")
+    try:
+        results = run_benchmark(workdir, corpus=args.corpus, questions=questions, docs=args.docs, pages=args.pages,
+                                n_questions=args.num_questions, top_k=args.top_k, repeats=args.repeats,
+                                workers=args.workers, generation_questions=args.generation_questions,
+                                stub_ttft_ms=args.stub_ttft_ms, stub_tokens_per_s=args.stub_tokens_per_s,
+                                seed=args.seed)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print_results(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"📝 Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+# calibrate_retrieval.py = fits the retrieval relevance thresholds to your own documents. Runs labelled questions
+# through EmbeddingManager.retrieve(), then picks the similarity / keyword / rerank cut-offs that best separate the
+# chunks that answer each question from the ones that don't (max F1), and prints them as ECHOPAL_* settings.
+#
+# Usage:
+#   python calibrate_retrieval.py labelled_questions.json [--json thresholds.json]
+#
+# labelled_questions.json:
+#   [{"question": "How often must the cloud usage policy be reviewed?",
+#     "sources": ["BNM_RMiT.pdf"], "expect": "at least once every three years"}, ...]
+# A retrieved chunk counts as relevant when it comes from one of `sources` and (if given) contains `expect`.
+
+import argparse
+import json
+
+from config import RETRIEVAL_CANDIDATES
+from embedding_manager import EmbeddingManager
+from hybrid_retrieval import best_threshold
+
+SIGNALS = {
+    "similarity": "ECHOPAL_RETRIEVAL_MIN_SIMILARITY",
+    "lexical_score": "ECHOPAL_RETRIEVAL_MIN_LEXICAL",
+    "rerank_score": "ECHOPAL_RERANK_MIN_SCORE",
+}
+
+
+def answers(hit, example):
+    """Does this retrieved chunk answer the labelled example?"""
+    expect = " ".join(example.get("expect", "").split()).lower()
+    return hit["source"] in example["sources"] and expect in " ".join(hit["text"].split()).lower()
+
+
+def label_hits(manager, examples, candidates=RETRIEVAL_CANDIDATES):
+    """Retrieve every example's candidates and return [(hit, is_relevant)]"""
+    labelled = []
+    for example in examples:
+        hits = manager.retrieve(example["question"], top_k=candidates, candidates=candidates)["hits"]
+        labelled.extend((hit, answers(hit, example)) for hit in hits)
+    return labelled
+
+
+def calibrate(labelled):
+    """Best threshold per signal, e.g. {"similarity": {"threshold": 0.81, "f1": 0.74, ...}}"""
+    thresholds = {}
+    for signal in SIGNALS:
+        pairs = [(hit[signal], relevant) for hit, relevant in labelled if hit.get(signal) is not None]
+        if not pairs or not any(relevant for _, relevant in pairs):
+            continue
+        threshold, f1, precision, recall = best_threshold(*zip(*pairs))
+        thresholds[signal] = {"threshold": round(threshold, 4), "f1": round(f1, 3),
+                              "precision": round(precision, 3), "recall": round(recall, 3), "samples": len(pairs)}
+    return thresholds
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fit EchoPal's retrieval relevance thresholds to labelled questions.")
+    parser.add_argument("examples", help="JSON list of {question, sources, expect?}")
+    parser.add_argument("--candidates", type=int, default=RETRIEVAL_CANDIDATES, help="hits scored per question")
+    parser.add_argument("--json", metavar="PATH", help="also write the thresholds as JSON")
+    args = parser.parse_args(argv)
+
+    with open(args.examples, "r", encoding="utf-8") as f:
+        examples = json.load(f)
+
+    labelled = label_hits(EmbeddingManager(), examples, candidates=args.candidates)
+    thresholds = calibrate(labelled)
+    relevant = sum(1 for _, is_relevant in labelled if is_relevant)
+    print(f"\n🎯 {len(examples)} questions, {len(labelled)} hits scored, {relevant} labelled relevant")
+    for signal, result in thresholds.items():
+        print(f"   {signal:<14}: >= {result['threshold']:.4f}  (F1 {result['f1']:.2f}, "
+              f"precision {result['precision']:.2f}, recall {result['recall']:.2f})")
+        print(f"   export {SIGNALS[signal]}={result['threshold']:.4f}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(thresholds, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+# chunker.py = token-aware, structure-preserving chunking for policy documents. Chunks are sized with the embedding
+# model's own tokenizer so nothing is truncated by the encoder, and they break at headings / numbered clauses /
+# sentences instead of every N words. Long clauses are split with a configurable token overlap.
+
+import re
+
+from config import CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS
+
+# Bump when the splitting rules change, so already-indexed pages get re-chunked
+CHUNKER_VERSION = 1
+
+# "1.", "10.49", "2.3.1", "(a)", "(iv)", "iv)", "a)" at the start of a line
+CLAUSE_RE = re.compile(r"^\s*(\d+(\.\d+)*\.?|\([a-z]{1,2}\)|\([ivxlc]{1,6}\)|[ivxlc]{1,6}\)|[a-z]\))\s+\S")
+# "Part A: Cloud Governance", "Section 3", "Appendix 2", or short ALL CAPS lines
+HEADING_RE = re.compile(r"^\s*((Part|Section|Appendix|Schedule|Chapter)\s+[\w.]+\b.*|[A-Z][A-Z0-9 ,&/\-]{3,80})\s*$")
+# Sentence ends: ., !, ? or ; followed by whitespace and an upper-case letter, digit or opening bracket
+SENTENCE_END_RE = re.compile(r"(?<=[.!?;])\s+(?=[A-Z0-9(])")
+WORD_RE = re.compile(r"\w+|[^\w\s]")
+
+
+def approximate_token_count(text):
+    """Rough word-piece count for encoders without a tokenizer (words and punctuation marks)"""
+    return len(WORD_RE.findall(text))
+
+
+class Chunker:
+    def __init__(self, count_tokens=None, max_tokens=CHUNK_MAX_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+        if overlap_tokens >= max_tokens:
+            raise ValueError("overlap_tokens must be smaller than max_tokens")
+        self.count_tokens = count_tokens or approximate_token_count
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+
+    @property
+    def signature(self):
+        """Identifies the chunking settings; stored in the registry so a settings change triggers re-chunking"""
+        return f"v{CHUNKER_VERSION}:max={self.max_tokens}:overlap={self.overlap_tokens}"
+
+    def chunk_page(self, text):
+        """Split one page of text into chunks of at most max_tokens tokens"""
+        chunks = []
+        current, current_tokens = [], 0
+
+        for block in self._blocks(text):
+            sentences = [(s, self.count_tokens(s)) for s in self._sentences(block)]
+            block_tokens = sum(n for _, n in sentences)
+
+            # Small clauses are packed together; a new clause starts a new chunk once the current one is full
+            if current and current_tokens + block_tokens > self.max_tokens:
+                chunks.append(" ".join(current))
+                current, current_tokens = [], 0
+
+            if block_tokens <= self.max_tokens:
+                current.append(block)
+                current_tokens += block_tokens
+                continue
+
+            # A clause longer than the encoder window: split at sentences, overlapping consecutive pieces
+            for piece in self._split_long_block(sentences):
+                chunks.append(piece)
+
+        if current:
+            chunks.append(" ".join(current))
+        return chunks
+
+    def _blocks(self, text):
+        """Group lines into blocks starting at headings or numbered clauses; a heading stays with what follows it"""
+        blocks, lines, heading_only = [], [], False
+        for line in text.splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            is_heading = bool(HEADING_RE.match(line))
+            if (is_heading or CLAUSE_RE.match(line)) and lines and not heading_only:
+                blocks.append(" ".join(lines))
+                lines = []
+            if not lines:
+                heading_only = is_heading
+            elif not is_heading:
+                heading_only = False
+            lines.append(line)
+        if lines:
+            blocks.append(" ".join(lines))
+        return blocks
+
+    def _sentences(self, block):
+        """Sentences of a block; a sentence that alone exceeds the window is cut into word windows"""
+        sentences = []
+        for sentence in SENTENCE_END_RE.split(block):
+            if self.count_tokens(sentence) <= self.max_tokens:
+                sentences.append(sentence)
+                continue
+            # Per-word counts keep this linear for long unpunctuated (e.g. OCR) runs
+            piece, piece_tokens = [], 0
+            for word in sentence.split():
+                word_tokens = self.count_tokens(word)
+                if piece and piece_tokens + word_tokens > self.max_tokens:
+                    sentences.append(" ".join(piece))
+                    piece, piece_tokens = [], 0
+                piece.append(word)
+                piece_tokens += word_tokens
+            if piece:
+                sentences.append(" ".join(piece))
+        return sentences
+
+    def _split_long_block(self, sentences):
+        pieces, current, current_tokens = [], [], 0
+        for sentence, n_tokens in sentences:
+            if current and current_tokens + n_tokens > self.max_tokens:
+                pieces.append(" ".join(s for s, _ in current))
+                # Carry the trailing sentences (up to overlap_tokens) into the next piece
+                overlap, overlap_tokens = [], 0
+                for prev, prev_tokens in reversed(current):
+                    if (overlap_tokens + prev_tokens > self.overlap_tokens
+                            or overlap_tokens + prev_tokens + n_tokens > self.max_tokens):
+                        break
+                    overlap.insert(0, (prev, prev_tokens))
+                    overlap_tokens += prev_tokens
+                current, current_tokens = overlap, overlap_tokens
+            current.append((sentence, n_tokens))
+            current_tokens += n_tokens
+        if current:
+            pieces.append(" ".join(s for s, _ in current))
+        return pieces
@@ -0,0 +1,107 @@
+# config.py = central settings for EchoPal's retrieval pipeline. Every value has a sensible default and can be
+# overridden with an ECHOPAL_* environment variable (e.g. in the Streamlit host's environment).
+
+import os
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# --- Vector store ---
+VECTOR_STORE_PATH = os.environ.get("ECHOPAL_VECTOR_STORE", os.path.join(BASE_DIR, "vector_store"))
+COLLECTION_NAME = os.environ.get("ECHOPAL_COLLECTION", "echopal_policies")
+VECTOR_BACKEND = os.environ.get("ECHOPAL_VECTOR_BACKEND", "chroma")        # chroma | numpy (in-process, memory-mapped)
+VECTOR_DTYPE = os.environ.get("ECHOPAL_VECTOR_DTYPE", "float32")           # numpy backend: float32 | int8 (4x smaller)
+VECTOR_MAX_SEGMENTS = int(os.environ.get("ECHOPAL_VECTOR_MAX_SEGMENTS", 16))         # numpy backend: merge beyond this
+VECTOR_COMPACT_RATIO = float(os.environ.get("ECHOPAL_VECTOR_COMPACT_RATIO", 0.2))    # numpy backend: dead-row share
+
+# --- Embedding model (used for both ingestion and query encoding) ---
+EMBEDDING_BACKEND = os.environ.get("ECHOPAL_EMBEDDING_BACKEND", "sentence-transformers")  # sentence-transformers | onnx
+EMBEDDING_MODEL = os.environ.get("ECHOPAL_EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+
+# ONNX backend: a folder with model.onnx + tokenizer.json (empty = download the model's ONNX export from the HF hub).
+# The variant picks the hub file, e.g. model_quint8_avx2 or model_qint8_avx512_vnni for int8-quantized graphs.
+ONNX_MODEL_PATH = os.environ.get("ECHOPAL_ONNX_MODEL_PATH", "")
+ONNX_VARIANT = os.environ.get("ECHOPAL_ONNX_VARIANT", "model")
+ONNX_THREADS = int(os.environ.get("ECHOPAL_ONNX_THREADS", 0))  # 0 = onnxruntime default (all cores)
+
+# Query encoding: LRU cache of recent query vectors; concurrent queries are encoded together (up to this many)
+QUERY_CACHE_SIZE = int(os.environ.get("ECHOPAL_QUERY_CACHE_SIZE", 1024))
+QUERY_MAX_BATCH = int(os.environ.get("ECHOPAL_QUERY_MAX_BATCH", 32))
+
+# --- Knowledge base folder (uploaded policy PDFs) ---
+KNOWLEDGE_BASE_PATH = os.environ.get("ECHOPAL_KNOWLEDGE_BASE", "knowledge_base")
+
+# --- Bulk ingestion ---
+INGEST_WORKERS = int(os.environ.get("ECHOPAL_INGEST_WORKERS", os.cpu_count() or 1))
+PAGES_PER_TASK = int(os.environ.get("ECHOPAL_PAGES_PER_TASK", 16))       # pages parsed per worker task
+EMBED_BATCH_SIZE = int(os.environ.get("ECHOPAL_EMBED_BATCH_SIZE", 64))    # chunks per encoder forward pass
+WRITE_BATCH_SIZE = int(os.environ.get("ECHOPAL_WRITE_BATCH_SIZE", 1000))  # rows per Chroma write (Chroma caps ~5k)
+
+# --- Extracted page text cache (re-chunking / re-embedding skips PDF parsing) ---
+PAGE_CACHE_PATH = os.environ.get("ECHOPAL_PAGE_CACHE", os.path.join(VECTOR_STORE_PATH, "page_cache"))
+PAGE_CACHE_MAX_MB = float(os.environ.get("ECHOPAL_PAGE_CACHE_MAX_MB", 512))  # least recently used evicted; 0 = off
+
+# --- Telemetry (tracing + metrics, see telemetry.py) ---
+TELEMETRY_LOG = os.environ.get("ECHOPAL_TELEMETRY_LOG", "")          # "" = off | "stdout" | path of a JSON-lines file
+TELEMETRY_PORT = int(os.environ.get("ECHOPAL_TELEMETRY_PORT", 0))     # serve /metrics + /metrics.json; 0 = off
+TELEMETRY_SAMPLES = int(os.environ.get("ECHOPAL_TELEMETRY_SAMPLES", 2048))  # recent samples kept for percentiles
+
+# --- Background ingestion jobs (admin uploads) ---
+JOBS_DB_PATH = os.environ.get("ECHOPAL_JOBS_DB", os.path.join(VECTOR_STORE_PATH, "ingest_jobs.sqlite3"))
+
+# --- Chunking (token counts use the embedding model's tokenizer; all-MiniLM-L6-v2 reads at most 256) ---
+CHUNK_MAX_TOKENS = int(os.environ.get("ECHOPAL_CHUNK_MAX_TOKENS", 200))
+CHUNK_OVERLAP_TOKENS = int(os.environ.get("ECHOPAL_CHUNK_OVERLAP_TOKENS", 40))
+
+# --- Hybrid retrieval (dense + BM25 candidates fused with reciprocal rank fusion) ---
+RETRIEVAL_CANDIDATES = int(os.environ.get("ECHOPAL_RETRIEVAL_CANDIDATES", 20))  # per retriever, before fusion
+RRF_K = int(os.environ.get("ECHOPAL_RRF_K", 60))
+BM25_K1 = float(os.environ.get("ECHOPAL_BM25_K1", 1.2))
+BM25_B = float(os.environ.get("ECHOPAL_BM25_B", 0.75))
+
+# Optional CPU cross-encoder rerank of the fused top-N (empty = off), e.g. cross-encoder/ms-marco-MiniLM-L-6-v2
+RERANK_MODEL = os.environ.get("ECHOPAL_RERANK_MODEL", "")
+RERANK_TOP_N = int(os.environ.get("ECHOPAL_RERANK_TOP_N", 12))
+
+# Relevance thresholds for chunks sent to the LLM; fit them to your documents with calibrate_retrieval.py
+RETRIEVAL_MIN_SIMILARITY = float(os.environ.get("ECHOPAL_RETRIEVAL_MIN_SIMILARITY", 0.875))  # cosine (= distance < 0.25)
+RETRIEVAL_MIN_LEXICAL = float(os.environ.get("ECHOPAL_RETRIEVAL_MIN_LEXICAL", 0.7))          # BM25 query coverage, 0-1
+RERANK_MIN_SCORE = float(os.environ.get("ECHOPAL_RERANK_MIN_SCORE", 0.5))                    # cross-encoder, 0-1
+
+# Per-stage latency budgets (ms); the lexical and rerank stages are cut short when they overrun
+BUDGET_EMBED_MS = float(os.environ.get("ECHOPAL_BUDGET_EMBED_MS", 100))
+BUDGET_DENSE_MS = float(os.environ.get("ECHOPAL_BUDGET_DENSE_MS", 250))
+BUDGET_LEXICAL_MS = float(os.environ.get("ECHOPAL_BUDGET_LEXICAL_MS", 100))
+BUDGET_RERANK_MS = float(os.environ.get("ECHOPAL_BUDGET_RERANK_MS", 400))
+
+# --- Semantic answer cache ---
+ANSWER_CACHE_SIZE = int(os.environ.get("ECHOPAL_ANSWER_CACHE_SIZE", 512))
+ANSWER_CACHE_TTL = float(os.environ.get("ECHOPAL_ANSWER_CACHE_TTL", 6 * 3600))           # seconds
+ANSWER_CACHE_SIMILARITY = float(os.environ.get("ECHOPAL_ANSWER_CACHE_SIMILARITY", 0.95))  # cosine, 0-1
+
+# --- Prompt assembly (token budgets use an approximate count; see prompt_builder.py) ---
+PROMPT_CONTEXT_TOKENS = int(os.environ.get("ECHOPAL_PROMPT_CONTEXT_TOKENS", 1200))  # retrieved context per answer
+PROMPT_HISTORY_TOKENS = int(os.environ.get("ECHOPAL_PROMPT_HISTORY_TOKENS", 250))   # conversation summary
+PROMPT_HISTORY_MESSAGES = int(os.environ.get("ECHOPAL_PROMPT_HISTORY_MESSAGES", 6))  # earlier messages summarised
+PROMPT_MIN_SENTENCE_SCORE = float(os.environ.get("ECHOPAL_PROMPT_MIN_SENTENCE_SCORE", 0.3))  # x best sentence's score
+
+# --- Generation (LLM) ---
+GENERATION_MODEL = os.environ.get("ECHOPAL_GENERATION_MODEL", "meta-llama/Llama-3.1-8B-Instruct")
+GENERATION_MAX_TOKENS = int(os.environ.get("ECHOPAL_GENERATION_MAX_TOKENS", 500))
+GENERATION_BACKEND = os.environ.get("ECHOPAL_GENERATION_BACKEND", "hf")              # hf | openai | stub
+GENERATION_TIMEOUT = float(os.environ.get("ECHOPAL_GENERATION_TIMEOUT", 60))          # seconds per request
+GENERATION_MAX_RETRIES = int(os.environ.get("ECHOPAL_GENERATION_MAX_RETRIES", 2))
+GENERATION_RETRY_BACKOFF = float(os.environ.get("ECHOPAL_GENERATION_RETRY_BACKOFF", 0.5))  # seconds, doubled per try
+GENERATION_MAX_CONCURRENCY = int(os.environ.get("ECHOPAL_GENERATION_MAX_CONCURRENCY", 4))  # in-flight requests
+GENERATION_BATCH_WINDOW_MS = float(os.environ.get("ECHOPAL_GENERATION_BATCH_WINDOW_MS", 20))
+GENERATION_MAX_BATCH = int(os.environ.get("ECHOPAL_GENERATION_MAX_BATCH", 8))
+
+# OpenAI-compatible server (vLLM, llama.cpp, TGI, stub_server.py ...)
+OPENAI_BASE_URL = os.environ.get("ECHOPAL_OPENAI_BASE_URL", "http://localhost:8000/v1")
+OPENAI_API_KEY = os.environ.get("ECHOPAL_OPENAI_API_KEY", "EMPTY")
+# Chat template for micro-batched raw /completions requests: llama3 | chatml. Empty = no batching, every request goes
+# through /chat/completions, where the server applies the model's own template
+OPENAI_PROMPT_TEMPLATE = os.environ.get("ECHOPAL_OPENAI_PROMPT_TEMPLATE", "")
+
+# Offline stub backend: simulated latency for load tests (0 = instant)
+STUB_TTFT_MS = float(os.environ.get("ECHOPAL_STUB_TTFT_MS", 0))
+STUB_TOKENS_PER_S = float(os.environ.get("ECHOPAL_STUB_TOKENS_PER_S", 0))
@@ -0,0 +1,121 @@
+# document_registry.py = keeps a small JSON index of every document in the vector store (source name -> chunk ids,
+# content hash, chunk count, ingest time) so lookups and deletes never have to scan the whole Chroma collection.
+
+import json
+import os
+import threading
+from datetime import datetime, timezone
+
+
+class DocumentRegistry:
+    def __init__(self, path, on_reload=None):
+        self.path = path
+        # on_reload(set_of_source_names) is told which documents another process added, changed or removed
+        self.on_reload = on_reload
+        self._lock = threading.Lock()
+        self._docs = {}
+        self._mtime = None
+        self._reload_if_changed()
+
+    def _reload_if_changed(self):
+        """Pick up writes from other processes (e.g. the bulk ingest CLI) with one stat() call"""
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return
+        if mtime != self._mtime:
+            with self._lock:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    docs = json.load(f)
+                changed = {source for source in set(self._docs) | set(docs)
+                           if self._docs.get(source) != docs.get(source)}
+                self._docs = docs
+                self._mtime = mtime
+            if changed and self.on_reload is not None:
+                self.on_reload(changed)
+
+    def refresh(self):
+        """Pick up another process's writes now (normally done lazily by every read)"""
+        self._reload_if_changed()
+
+    def exists_on_disk(self):
+        return os.path.exists(self.path)
+
+    def contains(self, source):
+        self._reload_if_changed()
+        return source in self._docs
+
+    def get(self, source):
+        self._reload_if_changed()
+        return self._docs.get(source)
+
+    def sources(self):
+        self._reload_if_changed()
+        return list(self._docs)
+
+    def entries(self):
+        """Snapshot of all entries as {source: entry}"""
+        self._reload_if_changed()
+        return dict(self._docs)
+
+    def total_chunks(self):
+        self._reload_if_changed()
+        return sum(entry["chunk_count"] for entry in self._docs.values())
+
+    def upsert(self, source, chunk_ids, content_hash=None, save=True, **extra):
+        """Record (or replace) a document and persist the registry (save=False to batch several upserts)"""
+        entry = {
+            "chunk_ids": list(chunk_ids),
+            "content_hash": content_hash,
+            "chunk_count": len(chunk_ids),
+            "ingested_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            **extra,
+        }
+        self._reload_if_changed()
+        with self._lock:
+            self._docs[source] = entry
+            if save:
+                self._save()
+        return entry
+
+    def save(self):
+        with self._lock:
+            self._save()
+
+    def remove(self, source):
+        """Forget a document; returns its old entry (or None)"""
+        self._reload_if_changed()
+        with self._lock:
+            entry = self._docs.pop(source, None)
+            if entry is not None:
+                self._save()
+        return entry
+
+    def rebuild_from_collection(self, collection):
+        """One-off migration for stores created before the registry existed (full metadata scan)"""
+        items = collection.get(include=["metadatas"])
+        grouped = {}
+        for doc_id, meta in zip(items["ids"], items["metadatas"]):
+            source = (meta or {}).get("source")
+            if source:
+                grouped.setdefault(source, []).append(doc_id)
+        with self._lock:
+            self._docs = {}
+            for source, ids in grouped.items():
+                self._docs[source] = {
+                    "chunk_ids": ids,
+                    "content_hash": None,  # unknown until the file is re-synced
+                    "chunk_count": len(ids),
+                    "ingested_at": None,
+                }
+            self._save()
+        return len(grouped)
+
+    def _save(self):
+        # Write to a temp file then swap, so a crash never leaves a half-written registry
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._docs, f, indent=1)
+        os.replace(tmp_path, self.path)
+        self._mtime = os.path.getmtime(self.path)
@@ -0,0 +1,386 @@
+# embedding_backend.py = pluggable text encoders for EchoPal. The same encoder embeds document chunks at ingest time
+# and user questions at query time, so stored vectors and query vectors always come from one model.
+# Heavy libraries (torch / sentence_transformers / onnxruntime) are imported on first encode, not at import time.
+#
+# Usage (accuracy + speed check of the ONNX export against the PyTorch reference):
+#   python embedding_backend.py parity [--variant model_quint8_avx2] [--texts questions.txt]
+#   python embedding_backend.py quantize --out models/minilm-int8   (then ECHOPAL_ONNX_MODEL_PATH=models/minilm-int8)
+
+import argparse
+import json
+import os
+import queue
+import shutil
+import statistics
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import numpy as np
+
+from config import (EMBEDDING_BACKEND, EMBEDDING_MODEL, ONNX_MODEL_PATH, ONNX_VARIANT, ONNX_THREADS,
+                    QUERY_CACHE_SIZE, QUERY_MAX_BATCH)
+
+# Shapes of common models, so the vector store can be opened before the (slow) model load
+KNOWN_MODELS = {
+    "all-MiniLM-L6-v2": {"dimension": 384, "max_tokens": 256},
+    "all-MiniLM-L12-v2": {"dimension": 384, "max_tokens": 256},
+    "all-mpnet-base-v2": {"dimension": 768, "max_tokens": 384},
+}
+
+
+class SentenceTransformerEncoder:
+    """Local SentenceTransformer model (default: all-MiniLM-L6-v2)"""
+
+    backend = "sentence-transformers"
+
+    def __init__(self, model_name=EMBEDDING_MODEL):
+        self.model_name = model_name
+        self._model = None
+        self._load_lock = threading.Lock()
+        known = KNOWN_MODELS.get(model_name)
+        self.dimension = known["dimension"] if known else self.model.get_sentence_embedding_dimension()
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._load_lock:
+                if self._model is None:
+                    # torch + sentence_transformers take seconds to import; only pay that on first use
+                    from sentence_transformers import SentenceTransformer
+                    self._model = SentenceTransformer(self.model_name)
+        return self._model
+
+    def encode(self, texts, batch_size=32):
+        """Embed a list of texts into a (n, dimension) float32 numpy array of unit vectors"""
+        return self.model.encode(
+            list(texts),
+            batch_size=batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+        )
+
+    def encode_query(self, query):
+        """Embed a single search query"""
+        return self.encode([query])[0]
+
+    @property
+    def max_tokens(self):
+        """Longest input (in tokens, including special tokens) the model reads before truncating"""
+        known = KNOWN_MODELS.get(self.model_name)
+        return known["max_tokens"] if known else self.model.max_seq_length
+
+    def count_tokens(self, text):
+        """Number of word-piece tokens the model's tokenizer produces for text (without special tokens)"""
+        return len(self.model.tokenizer.encode(text, add_special_tokens=False))
+
+
+class OnnxEncoder:
+    """The same sentence-transformers model run through an exported ONNX graph with onnxruntime on CPU.
+
+    Mean pooling + L2 normalisation are done in numpy, matching the model's SentenceTransformer pipeline, so its
+    vectors are interchangeable with SentenceTransformerEncoder's (check with `python embedding_backend.py parity`).
+    No torch import: cold start is the ONNX session load only.
+    """
+
+    backend = "onnx"
+
+    def __init__(self, model_name=EMBEDDING_MODEL, model_path=ONNX_MODEL_PATH, variant=ONNX_VARIANT,
+                 threads=ONNX_THREADS):
+        self.model_name = model_name
+        self.model_path = model_path
+        self.variant = variant
+        self.threads = threads
+        self._session = None
+        self._load_lock = threading.Lock()
+        known = KNOWN_MODELS.get(model_name)
+        self._max_tokens = known["max_tokens"] if known else None
+        if known:
+            self.dimension = known["dimension"]
+        else:
+            self._load()
+            self.dimension = self._output_dimension
+
+    def _load(self):
+        if self._session is None:
+            with self._load_lock:
+                if self._session is None:
+                    import onnxruntime as ort
+                    from tokenizers import Tokenizer
+
+                    model_file, tokenizer_file, max_tokens = self._resolve_files()
+                    options = ort.SessionOptions()
+                    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+                    if self.threads:
+                        options.intra_op_num_threads = self.threads
+                    session = ort.InferenceSession(model_file, options, providers=["CPUExecutionProvider"])
+
+                    self._max_tokens = self._max_tokens or max_tokens
+                    # Counting tokens must not truncate, so the chunker gets its own untruncated copy
+                    self._counter = Tokenizer.from_file(tokenizer_file)
+                    self._counter.no_truncation()
+                    self._counter.no_padding()
+                    self._tokenizer = Tokenizer.from_file(tokenizer_file)
+                    self._tokenizer.enable_truncation(max_length=self._max_tokens)
+                    pad_id = self._tokenizer.token_to_id("[PAD]") or 0
+                    self._tokenizer.enable_padding(pad_id=pad_id, pad_token="[PAD]")
+
+                    self._inputs = [i.name for i in session.get_inputs()]
+                    outputs = [o.name for o in session.get_outputs()]
+                    # Exports either stop at the token states or already include pooling
+                    self._pooled = "sentence_embedding" in outputs
+                    self._output = ("sentence_embedding" if self._pooled else
+                                    "last_hidden_state" if "last_hidden_state" in outputs else outputs[0])
+                    self._output_dimension = session.get_outputs()[outputs.index(self._output)].shape[-1]
+                    self._session = session
+
+    def _resolve_files(self):
+        """(model.onnx, tokenizer.json, max tokens) from ECHOPAL_ONNX_MODEL_PATH or the HF hub cache"""
+        if self.model_path:
+            folder = self.model_path
+            model_file = next((os.path.join(folder, name) for name in (f"{self.variant}.onnx", "model.onnx",
+                                                                       os.path.join("onnx", f"{self.variant}.onnx"))
+                               if os.path.exists(os.path.join(folder, name))), None)
+            if model_file is None:
+                raise FileNotFoundError(f"No {self.variant}.onnx or model.onnx in {folder}")
+            tokenizer_file = os.path.join(folder, "tokenizer.json")
+            config_file = os.path.join(folder, "sentence_bert_config.json")
+        else:
+            from huggingface_hub import hf_hub_download
+
+            repo = self.model_name if "/" in self.model_name else f"sentence-transformers/{self.model_name}"
+            model_file = hf_hub_download(repo, f"onnx/{self.variant}.onnx")
+            tokenizer_file = hf_hub_download(repo, "tokenizer.json")
+            try:
+                config_file = hf_hub_download(repo, "sentence_bert_config.json")
+            except Exception:
+                config_file = None
+
+        max_tokens = 512
+        if config_file and os.path.exists(config_file):
+            with open(config_file, "r", encoding="utf-8") as f:
+                max_tokens = json.load(f).get("max_seq_length", max_tokens)
+        return model_file, tokenizer_file, max_tokens
+
+    def encode(self, texts, batch_size=32):
+        """Embed a list of texts into a (n, dimension) float32 numpy array of unit vectors"""
+        self._load()
+        texts = list(texts)
+        out = np.empty((len(texts), self.dimension), dtype=np.float32)
+        # Similar lengths batched together waste less compute on padding
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            encodings = self._tokenizer.encode_batch([texts[i] for i in batch])
+            mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+            feed = {
+                "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+                "attention_mask": mask,
+                "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+            }
+            result = self._session.run([self._output], {name: feed[name] for name in self._inputs})[0]
+            if not self._pooled:
+                weights = mask[:, :, None].astype(np.float32)
+                result = (result * weights).sum(axis=1) / np.maximum(weights.sum(axis=1), 1e-9)
+            out[batch] = result / np.maximum(np.linalg.norm(result, axis=1, keepdims=True), 1e-12)
+        return out
+
+    def encode_query(self, query):
+        """Embed a single search query"""
+        return self.encode([query])[0]
+
+    @property
+    def max_tokens(self):
+        """Longest input (in tokens, including special tokens) the model reads before truncating"""
+        if self._max_tokens is None:
+            self._load()
+        return self._max_tokens
+
+    def count_tokens(self, text):
+        """Number of word-piece tokens the model's tokenizer produces for text (without special tokens)"""
+        self._load()
+        return len(self._counter.encode(text, add_special_tokens=False).ids)
+
+
+class QueryEncoder:
+    """encode_query() front end: an LRU cache of recent query vectors, and a worker thread that encodes queries
+    arriving at the same time as one batch (one forward pass instead of one per chat session).
+
+    The worker takes whatever is queued when it becomes free, so a lone query never waits for a batch to fill.
+    """
+
+    def __init__(self, encoder, cache_size=QUERY_CACHE_SIZE, max_batch=QUERY_MAX_BATCH):
+        self.encoder = encoder
+        self.cache_size = cache_size
+        self.max_batch = max_batch
+        self._cache = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._pending = queue.Queue()
+        self._thread = None
+        self._counts = {"hits": 0, "misses": 0, "batches": 0, "batched_queries": 0}
+
+    def encode_query(self, query):
+        """Unit vector for a query (read-only; shared between callers asking the same question)"""
+        key = query.strip()
+        with self._lock:
+            vector = self._cache.get(key)
+            if vector is not None:
+                self._cache.move_to_end(key)
+                self._counts["hits"] += 1
+                return vector
+            self._counts["misses"] += 1
+            # The same question already being encoded for another session: wait for that result
+            future = self._inflight.get(key)
+            if future is None:
+                future = self._inflight[key] = Future()
+                self._pending.put((key, future))
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._loop, name="echopal-query-encoder", daemon=True)
+                    self._thread.start()
+        return future.result()
+
+    def stats(self):
+        with self._lock:
+            lookups = self._counts["hits"] + self._counts["misses"]
+            return {**self._counts, "entries": len(self._cache),
+                    "hit_rate": self._counts["hits"] / lookups if lookups else 0.0}
+
+    def _loop(self):
+        while True:
+            batch = [self._pending.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._pending.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                vectors = self.encoder.encode([key for key, _ in batch], batch_size=len(batch))
+            except Exception as e:
+                with self._lock:
+                    for key, future in batch:
+                        self._inflight.pop(key, None)
+                        future.set_exception(e)
+                continue
+            with self._lock:
+                self._counts["batches"] += 1
+                self._counts["batched_queries"] += len(batch)
+                for (key, future), vector in zip(batch, vectors):
+                    vector = np.array(vector, dtype=np.float32)
+                    vector.setflags(write=False)
+                    if self.cache_size:
+                        self._cache[key] = vector
+                        self._cache.move_to_end(key)
+                    self._inflight.pop(key, None)
+                    future.set_result(vector)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
+
+# Registered encoder backends, selected with ECHOPAL_EMBEDDING_BACKEND
+ENCODERS = {
+    SentenceTransformerEncoder.backend: SentenceTransformerEncoder,
+    OnnxEncoder.backend: OnnxEncoder,
+}
+
+
+def load_encoder(backend=EMBEDDING_BACKEND, model_name=EMBEDDING_MODEL):
+    """Instantiate the configured encoder backend"""
+    if backend not in ENCODERS:
+        raise ValueError(f"Unknown embedding backend '{backend}'. Available: {', '.join(ENCODERS)}")
+    return ENCODERS[backend](model_name)
+
+
+# --- Parity check and quantization (command line) ---
+PARITY_TEXTS = [
+    "What must the board approve before cloud adoption?",
+    "How often should the cloud usage policy be reviewed?",
+    "paragraph 10.49",
+    "TRMF",
+    "Who is accountable for protecting customer data stored in the cloud?",
+    "(b) The senior management of a financial institution should develop and implement a cloud risk management "
+    "framework that integrates with existing outsourcing risk management framework, technology risk management "
+    "framework (TRMF) and cyber resilience framework (CRF), for the board's approval.",
+    "A financial institution should review their cloud service providers' certifications prior to entering into "
+    "any cloud arrangement or contract with such cloud service providers.",
+    "Jurisdiction risk may arise because cloud service providers operate regionally or globally in nature.",
+]
+
+
+def parity_check(candidate, reference, texts=PARITY_TEXTS, min_cosine=0.99, repeats=20):
+    """Compare two encoders on the same texts: per-text cosine, nearest-neighbour agreement and encode latency"""
+    def timed_load(encoder):
+        started = time.perf_counter()
+        encoder.encode(["warm up"])
+        return time.perf_counter() - started
+
+    def p50_ms(encoder):
+        samples = []
+        for i in range(repeats):
+            started = time.perf_counter()
+            encoder.encode([texts[i % len(texts)]])
+            samples.append((time.perf_counter() - started) * 1000)
+        return statistics.median(samples)
+
+    report = {"cold_start_s": {"candidate": timed_load(candidate), "reference": timed_load(reference)}}
+    a, b = candidate.encode(texts), reference.encode(texts)
+    cosines = (a * b).sum(axis=1)
+    # Does each text keep the same nearest neighbour among the others?
+    sim_a, sim_b = a @ a.T, b @ b.T
+    np.fill_diagonal(sim_a, -np.inf)
+    np.fill_diagonal(sim_b, -np.inf)
+    report.update({
+        "texts": len(texts),
+        "min_cosine": float(cosines.min()),
+        "mean_cosine": float(cosines.mean()),
+        "neighbour_agreement": float((sim_a.argmax(axis=1) == sim_b.argmax(axis=1)).mean()),
+        "p50_query_ms": {"candidate": p50_ms(candidate), "reference": p50_ms(reference)},
+    })
+    report["passed"] = report["min_cosine"] >= min_cosine
+    return report
+
+
+def quantize_onnx(out_dir, model_name=EMBEDDING_MODEL, model_path=ONNX_MODEL_PATH):
+    """Write a dynamically int8-quantized copy of the fp32 ONNX graph (+ tokenizer) to out_dir"""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    source = OnnxEncoder(model_name, model_path=model_path, variant="model")
+    model_file, tokenizer_file, max_tokens = source._resolve_files()
+    os.makedirs(out_dir, exist_ok=True)
+    quantize_dynamic(model_file, os.path.join(out_dir, "model.onnx"), weight_type=QuantType.QInt8)
+    shutil.copy(tokenizer_file, os.path.join(out_dir, "tokenizer.json"))
+    with open(os.path.join(out_dir, "sentence_bert_config.json"), "w", encoding="utf-8") as f:
+        json.dump({"max_seq_length": max_tokens}, f)
+    return out_dir
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check or quantize EchoPal's ONNX encoder.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    parity = sub.add_parser("parity", help="compare the ONNX encoder with the sentence-transformers reference")
+    parity.add_argument("--variant", default=ONNX_VARIANT, help="ONNX file to test (e.g. model_quint8_avx2)")
+    parity.add_argument("--model-path", default=ONNX_MODEL_PATH, help="local folder instead of the HF hub")
+    parity.add_argument("--texts", help="file with one text per line (default: built-in policy questions)")
+    parity.add_argument("--min-cosine", type=float, default=0.99, help="fail below this per-text cosine")
+    quantize = sub.add_parser("quantize", help="write an int8-quantized copy of the ONNX model")
+    quantize.add_argument("--out", required=True, help="output folder (use as ECHOPAL_ONNX_MODEL_PATH)")
+    args = parser.parse_args(argv)
+
+    if args.command == "quantize":
+        print(f"✅ Quantized model written to {quantize_onnx(args.out)}")
+        return
+
+    texts = PARITY_TEXTS
+    if args.texts:
+        with open(args.texts, "r", encoding="utf-8") as f:
+            texts = [line.strip() for line in f if line.strip()]
+    report = parity_check(OnnxEncoder(model_path=args.model_path, variant=args.variant),
+                          SentenceTransformerEncoder(), texts=texts, min_cosine=args.min_cosine)
+    print(json.dumps(report, indent=2))
+    print("✅ Parity check passed" if report["passed"] else "❌ Parity check failed: vectors differ too much")
+    raise SystemExit(0 if report["passed"] else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,100 +1,445 @@
 # embedding_manager.py = manages the embedding lifecycle for EchoPal by extracting text from PDFs, converting it into vector embeddings using a
 # SentenceTransformer, storing and searching them in a persistent ChromaDB database, and allowing document removal from the vector store.
+# The store itself is pluggable (vector_store.py): ChromaDB by default, or an in-process memory-mapped NumPy index.
 # Augmented part from RAG
 
+import hashlib
 import os
-import pdfplumber
-import chromadb
-from chromadb.config import Settings
-from sentence_transformers import SentenceTransformer
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import numpy as np
+
+from chunker import Chunker
+from config import (VECTOR_STORE_PATH, COLLECTION_NAME, EMBED_BATCH_SIZE, WRITE_BATCH_SIZE, CHUNK_MAX_TOKENS,
+                    RETRIEVAL_CANDIDATES, RERANK_TOP_N)
+from document_registry import DocumentRegistry
+from embedding_backend import QueryEncoder, load_encoder
+from hybrid_retrieval import LatencyBudget, reciprocal_rank_fusion, is_relevant
+from lexical_index import LexicalIndex
+from pdf_extract import extract_document
+from reranker import get_reranker
+from telemetry import annotate, get_metrics, inc, record_span
+from vector_store import open_vector_store
+
+# Runs the BM25 lookup beside the Chroma query so it can be abandoned when it overruns its budget
+_lexical_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="echopal-lexical")
+
+
+class ReadWriteLock:
+    """Lets many searches run together while uploads/deletes get exclusive access (writers are preferred)"""
 
-class EmbeddingManager:
     def __init__(self):
-        # Define absolute persistence path
-        base_dir = os.path.dirname(os.path.abspath(__file__))
-        persist_path = os.path.join(base_dir, "vector_store")
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def read_lock(self):
+        with self._cond:
+            while self._writer or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if self._readers == 0:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write_lock(self):
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+
+class EmbeddingManager:
+    def __init__(self, persist_path=VECTOR_STORE_PATH, encoder=None, chunker=None):
+        # Coordinates concurrent chat searches with the admin writer
+        self.lock = ReadWriteLock()
+        # Only one document is (re)indexed at a time; searches are blocked only while results are written
+        self._index_lock = threading.Lock()
+        # Callbacks told which sources changed after every ingest/delete (e.g. the answer cache)
+        self._change_listeners = []
+
+        # Load local embedding model (the only model used for both chunks and queries)
+        self.encoder = encoder or load_encoder()
+        # Query vectors go through an LRU cache and are batched across concurrent chat sessions
+        self.query_encoder = QueryEncoder(self.encoder)
+
+        # Chunks are sized with the encoder's tokenizer and never exceed its input window ([CLS]/[SEP] excluded)
+        self.chunker = chunker or Chunker(
+            count_tokens=getattr(self.encoder, "count_tokens", None),
+            max_tokens=min(CHUNK_MAX_TOKENS, getattr(self.encoder, "max_tokens", CHUNK_MAX_TOKENS + 2) - 2),
+        )
+
+        # Open the vector store (Chroma or the NumPy index) and check it was built with this encoder
+        self.store = open_vector_store(persist_path, COLLECTION_NAME, {
+            "embedding_model": self.encoder.model_name,
+            "embedding_dim": self.encoder.dimension,
+        })
+
+        # Source name -> chunk ids / hash / count, so we never scan the collection to find a document
+        # Writes by other processes (e.g. the bulk ingest CLI) reach the change listeners when the registry reloads
+        self.registry = DocumentRegistry(os.path.join(persist_path, "document_registry.json"),
+                                         on_reload=self._notify_change)
+        store_count = self.store.count()
+        # Also rebuilt when the store is empty but the registry isn't (e.g. after switching ECHOPAL_VECTOR_BACKEND),
+        # so the next sync re-indexes everything instead of skipping "unchanged" files
+        if (not self.registry.exists_on_disk() and store_count) or (not store_count and self.registry.sources()):
+            found = self.registry.rebuild_from_collection(self.store)
+            print(f"📇 Built document registry for {found} existing documents.")
+
+        # BM25 index over the same chunks, for exact terms the dense search misses
+        self.lexical = LexicalIndex(os.path.join(persist_path, "lexical_index.json"))
+        if len(self.lexical) != store_count:
+            found = self.lexical.rebuild_from_collection(self.store)
+            print(f"📇 Built lexical index for {found} existing chunks.")
 
-        # Load local embedding model
-        self.model = SentenceTransformer("all-MiniLM-L6-v2")
+    def add_change_listener(self, callback):
+        """Register callback(set_of_source_names), called after documents are re-indexed or deleted"""
+        self._change_listeners.append(callback)
 
-        # Initialize persistent ChromaDB storage with ABSOLUTE path
-        # self.client = chromadb.Client(Settings(persist_directory=persist_path))
-        self.client = chromadb.PersistentClient(path=persist_path)
+    def _notify_change(self, sources):
+        for callback in self._change_listeners:
+            try:
+                callback(set(sources))
+            except Exception as e:
+                print(f"⚠️ Change listener failed: {e}")
 
-        # Create or get collection
-        self.collection = self.client.get_or_create_collection(name="echopal_policies")
+    def warm_up(self):
+        """Run one tiny encode (and rerank) so the first real query doesn't pay the model start-up cost"""
+        self.encoder.encode(["warm up"])
+        reranker = get_reranker()
+        if reranker is not None:
+            reranker.score("warm up", ["warm up"])
+
+    def extract_pages(self, pdf_path, progress=None, content_hash=None):
+        """Extract the text of every page (empty string for pages without text), via the page cache"""
+        on_page = (lambda done, total: progress("extracting", done, total)) if progress else None
+        return extract_document(pdf_path, content_hash=content_hash or self.file_hash(pdf_path), on_page=on_page)
 
     def extract_text_from_pdf(self, pdf_path):
         """Extract text content from PDF"""
-        text = ""
-        with pdfplumber.open(pdf_path) as pdf:
-            for page in pdf.pages:
-                page_text = page.extract_text()
-                if page_text:
-                    text += page_text + "\n"
-        return text.strip()
-
-    def chunk_text(self, text, chunk_size=600):
-        """Split text into manageable chunks"""
-        words = text.split()
-        return [" ".join(words[i:i + chunk_size]) for i in range(0, len(words), chunk_size)]
+        return "\n".join(page for page in self.extract_pages(pdf_path) if page).strip()
+
+    def chunk_text(self, text):
+        """Split one page of text into encoder-sized chunks along headings, clauses and sentences"""
+        return self.chunker.chunk_page(text)
 
     # to prevent duplicate embedding
     def is_pdf_indexed(self, pdf_name):
-        items = self.collection.get(include=["metadatas"])
-        for meta in items["metadatas"]:
-            if meta.get("source") == pdf_name:
-                return True
-        return False
+        with self.lock.read_lock():
+            return self._is_pdf_indexed(pdf_name)
+
+    def _is_pdf_indexed(self, pdf_name):
+        return self.registry.contains(pdf_name)
+
+    def file_hash(self, pdf_path):
+        """SHA-256 of the file contents"""
+        digest = hashlib.sha256()
+        with open(pdf_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
 
     def add_pdf_to_collection(self, pdf_path):
-        """Extract text, embed, and store in Chroma"""
+        """Extract text, embed, and store in Chroma (only the parts that changed since the last upload)"""
+        return self.index_pdf(pdf_path)
+
+    def is_unchanged(self, pdf_name, content_hash):
+        """Same bytes and chunk settings as last time? (legacy entries count as changed and get re-indexed once)"""
+        entry = self.registry.get(pdf_name)
+        return (bool(entry) and entry.get("content_hash") == content_hash and "pages" in entry
+                and entry.get("chunker") == self.chunker.signature)
+
+    def unchanged_report(self, pdf_name):
+        entry = self.registry.get(pdf_name)
+        return {"status": "unchanged", "pdf": pdf_name, "chunks": entry["chunk_count"],
+                "chunks_added": 0, "chunks_removed": 0, "chunks_kept": entry["chunk_count"],
+                "pages_changed": 0, "pages_total": len(entry["pages"])}
+
+    def index_pdf(self, pdf_path, progress=None):
+        """Incrementally (re)index one PDF and return a report of what was touched.
+
+        progress(stage, done, total) is called as pages are extracted ("extracting") and chunks embedded ("embedding").
+        """
         pdf_name = os.path.basename(pdf_path)
+        content_hash = self.file_hash(pdf_path)
 
-        # Skip if already indexed
-        if self.is_pdf_indexed(pdf_name):
-            return  # just skip silently
+        if self.is_unchanged(pdf_name, content_hash):
+            print(f"⏭️ {pdf_name} unchanged, skipping.")
+            return self.unchanged_report(pdf_name)
 
-        text = self.extract_text_from_pdf(pdf_path)
-        chunks = self.chunk_text(text)
+        # Parse outside the write lock so searches keep running meanwhile
+        pages = self.extract_pages(pdf_path, progress=progress, content_hash=content_hash)
+        reports, _ = self.index_documents([(pdf_name, content_hash, pages)], progress=progress)
+        return reports[0]
 
-        # Generate local embeddings
-        embeddings = self.model.encode(chunks, convert_to_numpy=True).tolist()
+    def index_documents(self, documents, batch_size=EMBED_BATCH_SIZE, write_batch_size=WRITE_BATCH_SIZE,
+                        progress=None):
+        """Plan, embed and store already-extracted documents given as (pdf_name, content_hash, pages) tuples.
 
-        # Store in Chroma
-        self.collection.add(
-            documents=chunks,
-            metadatas=[{"source": pdf_name}] * len(chunks),
-            ids=[f"{pdf_name}_{i}" for i in range(len(chunks))]
-        )
-        print(f"✅ Added {len(chunks)} chunks from {pdf_name} to vector DB.")
-        return {"status": "added", "pdf": pdf_name, "chunks": len(chunks)}
-
-    def search(self, query, top_k: int =8):
-        """Search most relevant chunks and return (doc, source, distance) tuples."""
-        # ask Chroma for documents, metadatas and distances
-        print("🧠 Inside search(), running query for:", query)
-        results = self.collection.query(
-            query_texts=[query],
-            n_results=top_k,
-            include=["documents", "metadatas", "distances"]
-        )
+        Returns the per-document reports and the seconds spent in each stage.
+        """
+        timings = {}
+        with self._index_lock:
+            started = time.perf_counter()
+            plans = [self.plan_document(name, pages, content_hash) for name, content_hash, pages in documents]
+            timings["plan"] = time.perf_counter() - started
+
+            # Generate local embeddings only for new/changed chunks (these are the vectors Chroma stores)
+            started = time.perf_counter()
+            texts = [chunk["text"] for plan in plans for chunk in plan["to_add"]]
+            if progress:
+                progress("embedding", 0, len(texts))
+            vectors = []
+            for window in _batches(texts, batch_size * 8):
+                vectors.extend(self.encoder.encode(window, batch_size=batch_size).tolist())
+                if progress:
+                    progress("embedding", len(vectors), len(texts))
+            embeddings, offset = [], 0
+            for plan in plans:
+                embeddings.append(vectors[offset:offset + len(plan["to_add"])])
+                offset += len(plan["to_add"])
+            timings["embed"] = time.perf_counter() - started
+
+            started = time.perf_counter()
+            self.apply_plans(plans, embeddings, write_batch_size=write_batch_size)
+            timings["write"] = time.perf_counter() - started
+
+        for stage, seconds in timings.items():
+            record_span(f"index.{stage}", seconds)
+
+        reports = [self.plan_report(plan) for plan in plans]
+        for report in reports:
+            print(f"✅ {report['pdf']}: +{report['chunks_added']} / -{report['chunks_removed']} chunks "
+                  f"({report['chunks_kept']} unchanged) in vector DB.")
+        return reports, timings
+
+    def plan_document(self, pdf_name, pages, content_hash):
+        """Diff a document's pages/chunks against the registry: what to embed, keep, move or delete"""
+        old = self.registry.get(pdf_name) or {}
+        old_ids = set(old.get("chunk_ids", []))
+        old_pages = old.get("pages") or []
+        # Page-level reuse only holds if the pages were chunked with the same settings
+        same_chunker = old.get("chunker") == self.chunker.signature
+        old_page_chunks = {page["hash"]: page["chunk_ids"] for page in old_pages} if same_chunker else {}
+        old_page_of = {cid: number for number, page in enumerate(old_pages, start=1) for cid in page["chunk_ids"]}
+
+        page_hashes = [_sha1(text) for text in pages]
+
+        # Pass 1: pages whose text is unchanged keep their chunk ids without re-chunking
+        used_ids = set()
+        reused = {}
+        for number, page_hash in enumerate(page_hashes, start=1):
+            ids = old_page_chunks.get(page_hash)
+            if ids is not None and not used_ids.intersection(ids):
+                reused[number] = page_hash
+                used_ids.update(ids)
+
+        # Pass 2: chunk changed pages; chunk ids are content hashes, so unchanged chunks are still reused
+        new_pages, to_add, moved, chunk_ids = [], [], [], []
+        for number, (text, page_hash) in enumerate(zip(pages, page_hashes), start=1):
+            if number in reused:
+                ids = old_page_chunks[page_hash]
+            else:
+                ids = []
+                for chunk in self.chunk_text(text):
+                    chunk_hash = _sha1(chunk)
+                    chunk_id = _unique_id(f"{pdf_name}::{chunk_hash}", used_ids)
+                    used_ids.add(chunk_id)
+                    ids.append(chunk_id)
+                    if chunk_id not in old_ids:
+                        to_add.append({"id": chunk_id, "text": chunk, "page": number, "chunk_hash": chunk_hash})
 
-        docs = results.get("documents", [[]])[0]
-        metadatas = results.get("metadatas", [[]])[0]
-        distances = results.get("distances", [[]])[0]
+            # Kept chunks that now live on a different page only need a metadata update
+            for chunk_id in ids:
+                if chunk_id in old_ids and old_page_of.get(chunk_id) != number:
+                    moved.append({"id": chunk_id, "page": number})
 
-        # # ✅ Check if embeddings are actually stored
-        print("Number of embeddings in collection:",
-              len(self.collection.get(include=["embeddings"])["embeddings"]))
+            new_pages.append({"hash": page_hash, "chunk_ids": ids})
+            chunk_ids.extend(ids)
 
-        # Normalize length safety
-        tuples = []
-        for d, m, dist in zip(docs, metadatas, distances):
-            src = m.get("source") if isinstance(m, dict) else m
-            tuples.append((d, src, dist))
+        return {
+            "pdf": pdf_name,
+            "content_hash": content_hash,
+            "is_new": not old,
+            "pages": new_pages,
+            "chunk_ids": chunk_ids,
+            "to_add": to_add,
+            "to_delete": sorted(old_ids - set(chunk_ids)),
+            "moved": moved,
+            "pages_changed": len(pages) - len(reused),
+        }
 
-        return tuples
+    def apply_plan(self, plan, embeddings):
+        """Write a plan from plan_document() to Chroma and the registry"""
+        self.apply_plans([plan], [embeddings])
+
+    def apply_plans(self, plans, embeddings, write_batch_size=WRITE_BATCH_SIZE):
+        """Write several plans to the vector store in bulk batches, then record them in the registry.
+
+        New chunks go in before orphans are deleted, so a search never sees a document with pieces missing.
+        Each batch takes the write lock on its own so searches can interleave with a long bulk load.
+        """
+        rows = [(plan["pdf"], chunk, vector)
+                for plan, vectors in zip(plans, embeddings)
+                for chunk, vector in zip(plan["to_add"], vectors)]
+        for batch in _batches(rows, write_batch_size):
+            with self.lock.write_lock():
+                # upsert: a chunk written by an interrupted earlier run is simply overwritten
+                self.store.upsert(
+                    embeddings=[vector for _, _, vector in batch],
+                    documents=[chunk["text"] for _, chunk, _ in batch],
+                    metadatas=[{"source": pdf_name, "page": chunk["page"], "chunk_hash": chunk["chunk_hash"]}
+                               for pdf_name, chunk, _ in batch],
+                    ids=[chunk["id"] for _, chunk, _ in batch]
+                )
+        self.lexical.add((chunk["id"], chunk["text"], pdf_name) for pdf_name, chunk, _ in rows)
+
+        moved = [chunk for plan in plans for chunk in plan["moved"]]
+        for batch in _batches(moved, write_batch_size):
+            with self.lock.write_lock():
+                self.store.update_metadata(
+                    ids=[chunk["id"] for chunk in batch],
+                    metadatas=[{"page": chunk["page"]} for chunk in batch]
+                )
+
+        to_delete = [chunk_id for plan in plans for chunk_id in plan["to_delete"]]
+        for batch in _batches(to_delete, write_batch_size):
+            with self.lock.write_lock():
+                self.store.delete(ids=batch)
+        self.lexical.remove(to_delete)
+
+        with self.lock.write_lock():
+            for plan in plans:
+                self.registry.upsert(plan["pdf"], plan["chunk_ids"], content_hash=plan["content_hash"],
+                                     pages=plan["pages"], chunker=self.chunker.signature, save=False)
+            self.registry.save()
+            if rows or to_delete:
+                self.lexical.save()
+
+        changed = [plan["pdf"] for plan in plans if plan["to_add"] or plan["to_delete"] or plan["moved"]]
+        if changed:
+            self._notify_change(changed)
+
+    def plan_report(self, plan):
+        """Summarise a plan as the diff report returned to callers"""
+        return {
+            "status": "added" if plan["is_new"] else "updated",
+            "pdf": plan["pdf"],
+            "chunks": len(plan["chunk_ids"]),
+            "chunks_added": len(plan["to_add"]),
+            "chunks_removed": len(plan["to_delete"]),
+            "chunks_kept": len(plan["chunk_ids"]) - len(plan["to_add"]),
+            "pages_changed": plan["pages_changed"],
+            "pages_total": len(plan["pages"]),
+        }
+
+    def embed_query(self, query):
+        """Query vector from the same encoder that embedded the chunks (cached; concurrent queries batched)"""
+        return self.query_encoder.encode_query(query)
+
+    def retrieve(self, query, top_k: int = 8, query_embedding=None, candidates=RETRIEVAL_CANDIDATES, rerank=True):
+        """Hybrid search: dense + BM25 candidates fused with RRF, optional cross-encoder rerank, relevance flags.
+
+        Returns {"hits": [...], "timings": {...}}. Each hit is a dict with id, text, source, page, distance,
+        similarity, lexical_score, rrf_score, rerank_score (None when not reranked) and relevant.
+        """
+        budget = LatencyBudget()
+        if query_embedding is None:
+            with budget.stage("embed"):
+                query_embedding = self.embed_query(query)
+        query_vector = np.asarray(query_embedding, dtype=np.float32)
+
+        # --- Stage 1: dense and lexical candidates (the BM25 lookup runs beside the vector query) ---
+        lexical_started = time.perf_counter()
+        lexical_future = _lexical_pool.submit(self.lexical.search, query, candidates)
+        with budget.stage("dense"), self.lock.read_lock():
+            dense = self.store.query([query_vector], candidates)[0]
+        lexical = budget.wait(lexical_future, "lexical", lexical_started) or []
+
+        hits = {}
+        for chunk_id, doc, meta, dist in dense:
+            hits[chunk_id] = _make_hit(chunk_id, doc, meta, dist)
+
+        # Keyword-only candidates still need a dense similarity so one set of thresholds applies to every hit
+        missing = [chunk_id for chunk_id, _, _ in lexical if chunk_id not in hits]
+        if missing:
+            with budget.stage("fetch"), self.lock.read_lock():
+                items = self.store.get(ids=missing, include=["documents", "metadatas", "embeddings"])
+            for chunk_id, doc, meta, vector in zip(items["ids"], items["documents"], items["metadatas"],
+                                                   items["embeddings"]):
+                similarity = float(np.dot(np.asarray(vector, dtype=np.float32), query_vector))
+                hits[chunk_id] = _make_hit(chunk_id, doc, meta, 2.0 - 2.0 * similarity)
+        for chunk_id, _, coverage in lexical:
+            if chunk_id in hits:
+                hits[chunk_id]["lexical_score"] = coverage
+
+        # --- Stage 2: reciprocal rank fusion ---
+        with budget.stage("fuse"):
+            lexical_ids = [chunk_id for chunk_id, _, _ in lexical if chunk_id in hits]
+            fused = reciprocal_rank_fusion([[row[0] for row in dense], lexical_ids])
+            ranked = sorted(hits.values(), key=lambda hit: fused.get(hit["id"], 0.0), reverse=True)
+            for hit in ranked:
+                hit["rrf_score"] = fused.get(hit["id"], 0.0)
+
+        # --- Stage 3: optional cross-encoder rerank of the fused top-N, stopped at its deadline ---
+        reranker = get_reranker() if rerank else None
+        if reranker is not None and ranked:
+            ranked = self._rerank(reranker, query, ranked, budget)
+
+        for hit in ranked:
+            hit["relevant"] = is_relevant(hit)
+
+        timings = budget.report()
+        for stage, ms in timings["stages_ms"].items():
+            record_span(f"retrieve.{stage}", ms / 1000)
+        for stage in timings["over_budget"]:
+            inc("echopal_retrieval_budget_total", stage=stage, event="over_budget")
+        for skipped in timings["skipped"]:
+            inc("echopal_retrieval_budget_total", stage=skipped.split(" ", 1)[0], event="skipped")
+        if timings["over_budget"] or timings["skipped"]:
+            annotate(retrieval_over_budget=timings["over_budget"], retrieval_skipped=timings["skipped"])
+        return {"hits": ranked[:top_k], "timings": timings}
+
+    def _rerank(self, reranker, query, ranked, budget, batch_size=4):
+        """Rerank the head of the fused list in small batches until the rerank budget runs out"""
+        head = ranked[:RERANK_TOP_N]
+        started = time.perf_counter()
+        deadline = budget.deadline("rerank", started)
+        scored = 0
+        while scored < len(head):
+            if time.perf_counter() >= deadline:
+                budget.skip("rerank", f"scored {scored}/{len(head)} before the deadline")
+                break
+            batch = head[scored:scored + batch_size]
+            for hit, score in zip(batch, reranker.score(query, [hit["text"] for hit in batch])):
+                hit["rerank_score"] = float(score)
+            scored += len(batch)
+        budget.record("rerank", time.perf_counter() - started)
+        # Reranked hits first (best score first); any the deadline cut off keep their fused order
+        reranked = sorted(head[:scored], key=lambda hit: hit["rerank_score"], reverse=True)
+        return reranked + head[scored:] + ranked[len(head):]
+
+    def search(self, query, top_k: int =8, query_embedding=None):
+        """Search most relevant chunks and return (doc, source, distance) tuples (hybrid ranking, see retrieve())."""
+        hits = self.retrieve(query, top_k=top_k, query_embedding=query_embedding)["hits"]
+        return [(hit["text"], hit["source"], hit["distance"]) for hit in hits]
 
         # """Search most relevant chunks"""
         # results = self.collection.query(
@@ -108,34 +453,34 @@ class EmbeddingManager:
     def remove_pdf_from_collection(self, pdf_name):
         """Remove all chunks of a specific PDF from the vector DB and refresh collection"""
         print(f"🧹 Attempting to remove {pdf_name} from vector store...")
+        with self.lock.write_lock():
+            result = self._remove_pdf_from_collection(pdf_name)
+        self._notify_change([pdf_name])
+        return result
 
-        # Get all metadatas and ids
-        all_items = self.collection.get(include=["metadatas"])
-        all_metadatas = all_items["metadatas"]
-        all_ids = all_items["ids"]
+    def _remove_pdf_from_collection(self, pdf_name):
+        # Look the document up in the registry instead of scanning every row
+        entry = self.registry.remove(pdf_name)
 
-        # Match IDs by source metadata
-        ids_to_delete = [
-            doc_id for doc_id, meta in zip(all_ids, all_metadatas)
-            if meta.get("source") == pdf_name
-        ]
+        # Targeted delete by metadata; also catches stray chunks the registry never saw
+        self.store.delete_source(pdf_name)
+        if self.lexical.remove_source(pdf_name):
+            self.lexical.save()
 
-        if not ids_to_delete:
+        if entry is None:
             print(f"⚠️ No embeddings found for {pdf_name}.")
             return {"status": "not_found", "pdf": pdf_name}
 
-        # Delete matched embeddings
-        self.collection.delete(ids=ids_to_delete)
-        print(f"🗑️ Removed {len(ids_to_delete)} chunks of {pdf_name} from vector DB.")
+        print(f"🗑️ Removed {entry['chunk_count']} chunks of {pdf_name} from vector DB.")
 
         # ✅ Optional: compact database to free space and prevent ghost embeddings
         try:
-            self.client.persist()
-            print("💾 ChromaDB persisted after cleanup.")
+            self.store.persist()
+            print(f"💾 Vector store ({self.store.backend}) persisted after cleanup.")
         except Exception as e:
             print(f"⚠️ Persist error (safe to ignore): {e}")
 
-        return {"status": "removed", "pdf": pdf_name, "deleted_chunks": len(ids_to_delete)}
+        return {"status": "removed", "pdf": pdf_name, "deleted_chunks": entry["chunk_count"]}
 
         # """Remove all chunks of a specific PDF from the vector DB"""
         # # Get all documents and metadatas
@@ -155,4 +500,83 @@ class EmbeddingManager:
         #
         # # Delete the selected chunks
         # self.collection.delete(ids=all_ids)
-        # print(f"🗑️ Removed {len(all_ids)} chunks from {pdf_name} in vector DB.")
\ No newline at end of file
+        # print(f"🗑️ Removed {len(all_ids)} chunks from {pdf_name} in vector DB.")
+
+
+def _sha1(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def _make_hit(chunk_id, doc, meta, distance):
+    meta = meta if isinstance(meta, dict) else {}
+    return {
+        "id": chunk_id,
+        "text": doc,
+        "source": meta.get("source"),
+        "page": meta.get("page"),
+        "distance": distance,
+        # Vectors are unit length and Chroma reports squared L2, so cosine = 1 - d / 2
+        "similarity": 1.0 - distance / 2.0,
+        "lexical_score": 0.0,
+        "rrf_score": 0.0,
+        "rerank_score": None,
+    }
+
+
+def _batches(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _unique_id(base_id, used_ids):
+    """Suffix repeated chunks (e.g. identical footers) so every id in a document is unique"""
+    if base_id not in used_ids:
+        return base_id
+    n = 1
+    while f"{base_id}#{n}" in used_ids:
+        n += 1
+    return f"{base_id}#{n}"
+
+
+# --- Process-wide shared manager ---
+# One model and one Chroma client per server process, shared by every Streamlit session.
+_shared_manager = None
+_shared_manager_lock = threading.Lock()
+_warmup_thread = None
+
+
+def get_shared_manager():
+    """Return the process-wide EmbeddingManager, loading it on first use"""
+    global _shared_manager
+    if _shared_manager is None:
+        with _shared_manager_lock:
+            if _shared_manager is None:
+                manager = EmbeddingManager()
+                manager.warm_up()
+                _register_gauges(manager)
+                _shared_manager = manager
+    return _shared_manager
+
+
+def warm_up_in_background():
+    """Start loading the shared manager in a daemon thread (e.g. while the login page is showing)"""
+    global _warmup_thread
+    with _shared_manager_lock:
+        if _shared_manager is not None or _warmup_thread is not None:
+            return
+        _warmup_thread = threading.Thread(target=get_shared_manager, name="echopal-warmup", daemon=True)
+    _warmup_thread.start()
+
+
+def _register_gauges(manager):
+    """Expose index size and query cache counts to telemetry (read at export time)"""
+    metrics = get_metrics()
+    metrics.register_gauge("echopal_index_chunks", manager.store.count, "Chunks in the vector store")
+    metrics.register_gauge("echopal_index_documents", lambda: len(manager.registry.sources()), "Indexed documents")
+    metrics.register_gauge("echopal_query_cache_entries", lambda: manager.query_encoder.stats()["entries"],
+                           "Query embeddings held in the LRU cache")
+    metrics.register_gauge(
+        "echopal_query_cache_lookups_total",
+        lambda: [({"result": result}, manager.query_encoder.stats()[key]) for result, key in
+                 (("hit", "hits"), ("miss", "misses"))],
+        "Query embedding cache lookups", kind="counter")
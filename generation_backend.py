@@ -0,0 +1,415 @@
+# generation_backend.py = pluggable LLM backends for EchoPal's answer generation: Hugging Face Inference (the default),
+# any OpenAI-compatible server (vLLM, llama.cpp, TGI, the local stand-in in stub_server.py), and a deterministic offline
+# stub for load tests. All backends share timeouts, retry with backoff, a concurrency limit and micro-batching.
+
+import asyncio
+import hashlib
+import json
+import queue
+import random
+import re
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import asynccontextmanager, contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+from huggingface_hub import AsyncInferenceClient, InferenceClient
+
+from config import (GENERATION_BACKEND, GENERATION_MODEL, GENERATION_MAX_TOKENS, GENERATION_TIMEOUT,
+                    GENERATION_MAX_RETRIES, GENERATION_RETRY_BACKOFF, GENERATION_MAX_CONCURRENCY,
+                    GENERATION_BATCH_WINDOW_MS, GENERATION_MAX_BATCH, OPENAI_BASE_URL, OPENAI_API_KEY,
+                    OPENAI_PROMPT_TEMPLATE, STUB_TTFT_MS, STUB_TOKENS_PER_S)
+from telemetry import inc
+
+try:
+    # AsyncInferenceClient's transport; its connection errors don't subclass the builtin ConnectionError
+    import aiohttp
+    ASYNC_CONNECTION_ERRORS = (aiohttp.ClientConnectionError,)
+except ImportError:
+    ASYNC_CONNECTION_ERRORS = ()
+
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+class BackendBusyError(RuntimeError):
+    """No generation slot became free within the timeout"""
+
+
+def is_transient(error):
+    """Timeouts, dropped connections and 408/429/5xx responses are worth retrying"""
+    if isinstance(error, (TimeoutError, ConnectionError, requests.Timeout, requests.ConnectionError,
+                          *ASYNC_CONNECTION_ERRORS)):
+        return True
+    # requests errors carry .response.status_code, aiohttp.ClientResponseError carries .status
+    status = getattr(getattr(error, "response", None), "status_code", None) or getattr(error, "status", None)
+    return status in RETRYABLE_STATUS
+
+
+class GenerationBackend:
+    """Base class: subclasses implement _open_stream() and, if they can, _complete_batch()"""
+
+    name = "base"
+    supports_batching = False
+
+    def __init__(self, model=GENERATION_MODEL, timeout=GENERATION_TIMEOUT, max_retries=GENERATION_MAX_RETRIES,
+                 retry_backoff=GENERATION_RETRY_BACKOFF, max_concurrency=GENERATION_MAX_CONCURRENCY,
+                 batch_window_ms=GENERATION_BATCH_WINDOW_MS, max_batch=GENERATION_MAX_BATCH):
+        self.model = model
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.max_concurrency = max_concurrency
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._batcher = MicroBatcher(self, batch_window_ms, max_batch) if self.supports_batching else None
+
+    # --- to implement ---
+    def _open_stream(self, messages, max_tokens):
+        """Yield text deltas for one chat request"""
+        raise NotImplementedError
+
+    def _complete_batch(self, batch, max_tokens):
+        """Return one completion per messages list in `batch` using a single backend request"""
+        raise NotImplementedError
+
+    # --- public API ---
+    def stream(self, messages, max_tokens=GENERATION_MAX_TOKENS, cancel_event=None):
+        """Yield text deltas; retried with backoff if the request fails before the first token"""
+        with self._slot():
+            attempt = 0
+            while True:
+                inner, yielded = self._open_stream(messages, max_tokens), False
+                try:
+                    for delta in inner:
+                        if cancel_event is not None and cancel_event.is_set():
+                            return
+                        yielded = True
+                        yield delta
+                    return
+                except Exception as e:
+                    # Once tokens reached the caller a retry would duplicate them
+                    if yielded or attempt >= self.max_retries or not is_transient(e):
+                        raise
+                    inc("echopal_llm_retries_total", backend=self.name)
+                    time.sleep(self._backoff_delay(attempt))
+                    attempt += 1
+                finally:
+                    inner.close()
+
+    async def astream(self, messages, max_tokens=GENERATION_MAX_TOKENS, cancel_event=None):
+        """Async variant of stream(); the default bridges the sync stream through a worker thread"""
+        loop = asyncio.get_running_loop()
+        deltas = asyncio.Queue()
+        done = object()
+
+        def pump():
+            try:
+                for delta in self.stream(messages, max_tokens, cancel_event):
+                    loop.call_soon_threadsafe(deltas.put_nowait, delta)
+            except Exception as e:
+                loop.call_soon_threadsafe(deltas.put_nowait, e)
+            finally:
+                loop.call_soon_threadsafe(deltas.put_nowait, done)
+
+        threading.Thread(target=pump, daemon=True).start()
+        while (item := await deltas.get()) is not done:
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    def complete(self, messages, max_tokens=GENERATION_MAX_TOKENS):
+        """Full (non-streamed) completion; concurrent calls are micro-batched when the backend supports it"""
+        if self._batcher is not None:
+            return self._batcher.submit(messages, max_tokens).result(timeout=self.timeout * (self.max_retries + 1))
+        return "".join(self.stream(messages, max_tokens))
+
+    # --- helpers ---
+    @contextmanager
+    def _slot(self):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise BackendBusyError(f"All {self.max_concurrency} {self.name} generation slots busy for {self.timeout}s")
+        try:
+            yield
+        finally:
+            self._slots.release()
+
+    @asynccontextmanager
+    async def _aslot(self):
+        """_slot() for coroutines: the same semaphore, waited on in a worker thread so the event loop keeps running"""
+        acquire = asyncio.ensure_future(asyncio.to_thread(self._slots.acquire, timeout=self.timeout))
+        try:
+            acquired = await asyncio.shield(acquire)
+        except asyncio.CancelledError:
+            # The thread may still get the slot after we gave up waiting; hand it straight back
+            acquire.add_done_callback(lambda f: f.cancelled() or not f.result() or self._slots.release())
+            raise
+        if not acquired:
+            raise BackendBusyError(f"All {self.max_concurrency} {self.name} generation slots busy for {self.timeout}s")
+        try:
+            yield
+        finally:
+            self._slots.release()
+
+    def _backoff_delay(self, attempt):
+        # Exponential backoff with jitter
+        return self.retry_backoff * (2 ** attempt) * (0.5 + random.random() / 2)
+
+    def _with_retries(self, fn):
+        attempt = 0
+        while True:
+            try:
+                return fn()
+            except Exception as e:
+                if attempt >= self.max_retries or not is_transient(e):
+                    raise
+                inc("echopal_llm_retries_total", backend=self.name)
+                time.sleep(self._backoff_delay(attempt))
+                attempt += 1
+
+
+class MicroBatcher:
+    """Collects complete() calls arriving within a short window and sends them as one batched request"""
+
+    def __init__(self, backend, window_ms=GENERATION_BATCH_WINDOW_MS, max_batch=GENERATION_MAX_BATCH):
+        self.backend = backend
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._pending = queue.Queue()
+        self._thread = threading.Thread(target=self._loop, name=f"echopal-{backend.name}-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, messages, max_tokens):
+        future = Future()
+        self._pending.put((messages, max_tokens, future))
+        return future
+
+    def _loop(self):
+        while True:
+            batch = [self._pending.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._pending.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            # One request per distinct max_tokens value
+            groups = {}
+            for item in batch:
+                groups.setdefault(item[1], []).append(item)
+            for max_tokens, items in groups.items():
+                threading.Thread(target=self._run, args=(items, max_tokens), daemon=True).start()
+
+    def _run(self, items, max_tokens):
+        try:
+            with self.backend._slot():
+                results = self.backend._with_retries(
+                    lambda: self.backend._complete_batch([messages for messages, _, _ in items], max_tokens))
+        except Exception as e:
+            for _, _, future in items:
+                future.set_exception(e)
+            return
+        for (_, _, future), text in zip(items, results):
+            future.set_result(text)
+
+
+class HFInferenceBackend(GenerationBackend):
+    """Hugging Face Inference API (serverless or dedicated endpoint); token from the environment / HF login"""
+
+    name = "hf"
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # One reusable client per concurrency slot
+        self._clients = queue.Queue()
+        for _ in range(self.max_concurrency):
+            self._clients.put(InferenceClient(model=self.model, timeout=self.timeout))
+        self._async_client = None
+
+    def _open_stream(self, messages, max_tokens):
+        client = self._clients.get()
+        try:
+            stream = client.chat_completion(messages=messages, max_tokens=max_tokens, stream=True)
+            try:
+                for chunk in stream:
+                    delta = chunk.choices[0].delta.get("content", "")
+                    if delta:
+                        yield delta
+            finally:
+                if hasattr(stream, "close"):
+                    stream.close()
+        finally:
+            self._clients.put(client)
+
+    async def astream(self, messages, max_tokens=GENERATION_MAX_TOKENS, cancel_event=None):
+        # Native async client: no thread per stream, but the same concurrency slots and retry policy as stream()
+        if self._async_client is None:
+            self._async_client = AsyncInferenceClient(model=self.model, timeout=self.timeout)
+        async with self._aslot():
+            attempt = 0
+            while True:
+                stream, yielded = None, False
+                try:
+                    stream = await self._async_client.chat_completion(messages=messages, max_tokens=max_tokens,
+                                                                      stream=True)
+                    async for chunk in stream:
+                        if cancel_event is not None and cancel_event.is_set():
+                            return
+                        delta = chunk.choices[0].delta.get("content", "")
+                        if delta:
+                            yielded = True
+                            yield delta
+                    return
+                except Exception as e:
+                    # Once tokens reached the caller a retry would duplicate them
+                    if yielded or attempt >= self.max_retries or not is_transient(e):
+                        raise
+                    inc("echopal_llm_retries_total", backend=self.name)
+                    await asyncio.sleep(self._backoff_delay(attempt))
+                    attempt += 1
+                finally:
+                    if stream is not None and hasattr(stream, "aclose"):
+                        await stream.aclose()
+
+
+class OpenAICompatibleBackend(GenerationBackend):
+    """Any server speaking the OpenAI chat API (vLLM, llama.cpp server, TGI, LM Studio, stub_server.py)"""
+
+    name = "openai"
+
+    def __init__(self, base_url=OPENAI_BASE_URL, api_key=OPENAI_API_KEY, prompt_template=OPENAI_PROMPT_TEMPLATE,
+                 **kwargs):
+        self.base_url = base_url.rstrip("/")
+        # Raw /completions batches need the model's chat template rendered client-side, so they are opt-in
+        if prompt_template and prompt_template not in PROMPT_TEMPLATES:
+            raise ValueError(f"Unknown prompt template '{prompt_template}'. Available: {', '.join(PROMPT_TEMPLATES)}")
+        self.render_prompt = PROMPT_TEMPLATES.get(prompt_template)
+        self.supports_batching = self.render_prompt is not None
+        # Pooled keep-alive connections, one per concurrency slot
+        self.session = requests.Session()
+        self.session.headers["Authorization"] = f"Bearer {api_key}"
+        super().__init__(**kwargs)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _open_stream(self, messages, max_tokens):
+        response = self.session.post(
+            f"{self.base_url}/chat/completions",
+            json={"model": self.model, "messages": messages, "max_tokens": max_tokens, "stream": True},
+            stream=True,
+            timeout=(5, self.timeout),
+        )
+        try:
+            response.raise_for_status()
+            # Server-sent events: "data: {json}" lines, terminated by "data: [DONE]"
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                choices = json.loads(data).get("choices") or [{}]
+                delta = (choices[0].get("delta") or {}).get("content")
+                if delta:
+                    yield delta
+        finally:
+            response.close()
+
+    def _complete_batch(self, batch, max_tokens):
+        # The completions endpoint accepts a list of prompts and answers them in one forward batch
+        response = self.session.post(
+            f"{self.base_url}/completions",
+            json={"model": self.model, "prompt": [self.render_prompt(messages) for messages in batch],
+                  "max_tokens": max_tokens},
+            timeout=(5, self.timeout),
+        )
+        response.raise_for_status()
+        choices = sorted(response.json()["choices"], key=lambda choice: choice.get("index", 0))
+        return [choice["text"] for choice in choices]
+
+
+class StubBackend(GenerationBackend):
+    """Deterministic offline LLM: echoes the start of the prompt's context, with optional simulated latency"""
+
+    name = "stub"
+    supports_batching = True
+
+    def __init__(self, ttft_ms=STUB_TTFT_MS, tokens_per_s=STUB_TOKENS_PER_S, **kwargs):
+        self.ttft_ms = ttft_ms
+        self.tokens_per_s = tokens_per_s
+        super().__init__(**kwargs)
+
+    def answer(self, messages, max_tokens=GENERATION_MAX_TOKENS):
+        """The full deterministic answer for a conversation"""
+        prompt = messages[-1]["content"]
+        match = re.search(r"Context:\s*(.*?)(?:\n\s*Question:|$)", prompt, re.S)
+        context = " ".join((match.group(1) if match else prompt).split())
+        digest = hashlib.sha1(prompt.encode("utf-8")).hexdigest()[:8]
+        words = f"[stub {digest}] Based on the policy context: {context}".split()
+        return " ".join(words[:max_tokens])
+
+    def _open_stream(self, messages, max_tokens):
+        if self.ttft_ms:
+            time.sleep(self.ttft_ms / 1000)
+        for i, word in enumerate(self.answer(messages, max_tokens).split(" ")):
+            if self.tokens_per_s:
+                time.sleep(1 / self.tokens_per_s)
+            yield word if i == 0 else " " + word
+
+    def _complete_batch(self, batch, max_tokens):
+        if self.ttft_ms:
+            time.sleep(self.ttft_ms / 1000)
+        return [self.answer(messages, max_tokens) for messages in batch]
+
+
+# Raw /completions prompts. No BOS token: vLLM, TGI and llama.cpp add it when they tokenize the prompt.
+def llama3_prompt(messages):
+    """Render chat messages with the Llama 3 instruct template"""
+    parts = []
+    for message in messages:
+        parts.append(f"<|start_header_id|>{message['role']}<|end_header_id|>\n\n{message['content']}<|eot_id|>")
+    parts.append("<|start_header_id|>assistant<|end_header_id|>\n\n")
+    return "".join(parts)
+
+
+def chatml_prompt(messages):
+    """Render chat messages with the ChatML template (Qwen, many Mistral and Phi fine-tunes)"""
+    parts = [f"<|im_start|>{message['role']}\n{message['content']}<|im_end|>\n" for message in messages]
+    parts.append("<|im_start|>assistant\n")
+    return "".join(parts)
+
+
+# Selected with ECHOPAL_OPENAI_PROMPT_TEMPLATE
+PROMPT_TEMPLATES = {"llama3": llama3_prompt, "chatml": chatml_prompt}
+
+
+# Registered backends, selected with ECHOPAL_GENERATION_BACKEND
+BACKENDS = {
+    HFInferenceBackend.name: HFInferenceBackend,
+    OpenAICompatibleBackend.name: OpenAICompatibleBackend,
+    StubBackend.name: StubBackend,
+}
+
+
+def load_backend(name=GENERATION_BACKEND, **kwargs):
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown generation backend '{name}'. Available: {', '.join(BACKENDS)}")
+    return BACKENDS[name](**kwargs)
+
+
+# --- Process-wide shared backend ---
+_shared_backend = None
+_shared_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _shared_backend
+    with _shared_backend_lock:
+        if _shared_backend is None:
+            _shared_backend = load_backend()
+    return _shared_backend
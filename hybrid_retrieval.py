@@ -0,0 +1,111 @@
+# hybrid_retrieval.py = building blocks for EmbeddingManager.retrieve(): reciprocal rank fusion of the dense and BM25
+# rankings, per-stage latency budgets, and the relevance thresholds that decide which chunks reach the LLM.
+
+import time
+from concurrent.futures import TimeoutError as FutureTimeout
+from contextlib import contextmanager
+
+from config import (RRF_K, RETRIEVAL_MIN_SIMILARITY, RETRIEVAL_MIN_LEXICAL, RERANK_MIN_SCORE,
+                    BUDGET_EMBED_MS, BUDGET_DENSE_MS, BUDGET_LEXICAL_MS, BUDGET_RERANK_MS)
+
+# Optional stages (lexical, rerank) are cut short when they overrun; required ones (embed, dense) are only reported
+STAGE_BUDGETS_MS = {
+    "embed": BUDGET_EMBED_MS,
+    "dense": BUDGET_DENSE_MS,
+    "lexical": BUDGET_LEXICAL_MS,
+    "rerank": BUDGET_RERANK_MS,
+}
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """Fuse ranked id lists: score(id) = sum of 1 / (k + rank). Returns {id: score}.
+
+    RRF only looks at ranks, so BM25 scores and cosine similarities never have to be put on one scale.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, item_id in enumerate(ranking, start=1):
+            scores[item_id] = scores.get(item_id, 0.0) + 1.0 / (k + rank)
+    return scores
+
+
+class LatencyBudget:
+    """Times each retrieval stage against its budget and records which stages overran or were skipped"""
+
+    def __init__(self, budgets_ms=None):
+        self.budgets_ms = budgets_ms or STAGE_BUDGETS_MS
+        self.started = time.perf_counter()
+        self.stages_ms = {}
+        self.over_budget = []
+        self.skipped = []
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def record(self, name, seconds):
+        self.stages_ms[name] = self.stages_ms.get(name, 0.0) + seconds * 1000
+        budget = self.budgets_ms.get(name)
+        if budget is not None and self.stages_ms[name] > budget and name not in self.over_budget:
+            self.over_budget.append(name)
+
+    def deadline(self, name, started=None):
+        """perf_counter() time by which stage `name` (started now or at `started`) must finish"""
+        return (started or time.perf_counter()) + self.budgets_ms.get(name, float("inf")) / 1000
+
+    def wait(self, future, name, started):
+        """Result of a stage running in another thread, or None if it misses its deadline"""
+        try:
+            result = future.result(timeout=max(0.0, self.deadline(name, started) - time.perf_counter()))
+        except FutureTimeout:
+            self.skip(name, "over budget")
+            self.record(name, time.perf_counter() - started)
+            return None
+        self.record(name, time.perf_counter() - started)
+        return result
+
+    def skip(self, name, reason):
+        self.skipped.append(f"{name} ({reason})")
+
+    def report(self):
+        return {
+            "stages_ms": {name: round(ms, 2) for name, ms in self.stages_ms.items()},
+            "total_ms": round((time.perf_counter() - self.started) * 1000, 2),
+            "over_budget": self.over_budget,
+            "skipped": self.skipped,
+        }
+
+
+def is_relevant(hit, min_similarity=RETRIEVAL_MIN_SIMILARITY, min_lexical=RETRIEVAL_MIN_LEXICAL,
+                min_rerank=RERANK_MIN_SCORE):
+    """Decide whether a hit is grounded enough to send to the LLM.
+
+    A cross-encoder score, when there is one, is the most reliable signal and decides alone. Otherwise a chunk
+    passes on dense similarity or on keyword coverage (exact clause numbers and acronyms the encoder blurs).
+    """
+    if hit.get("rerank_score") is not None:
+        return hit["rerank_score"] >= min_rerank
+    return hit["similarity"] >= min_similarity or hit["lexical_score"] >= min_lexical
+
+
+def best_threshold(values, labels):
+    """Threshold on `values` that maximises F1 for the boolean `labels`; returns (threshold, f1, precision, recall)"""
+    pairs = sorted(zip(values, labels), key=lambda pair: pair[0], reverse=True)
+    positives = sum(1 for _, label in pairs if label)
+    best = (None, 0.0, 0.0, 0.0)
+    true_pos = 0
+    for i, (value, label) in enumerate(pairs, start=1):
+        true_pos += bool(label)
+        # Only cut between distinct values, so every item scoring `value` is on the accepted side
+        if i < len(pairs) and pairs[i][0] == value:
+            continue
+        precision = true_pos / i
+        recall = true_pos / positives if positives else 0.0
+        f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+        if f1 > best[1]:
+            best = (value, f1, precision, recall)
+    return best
@@ -0,0 +1,237 @@
+# ingest.py = command-line bulk ingestion for EchoPal. Extracts PDF pages in parallel across a process pool,
+# batch-encodes only new/changed chunks and writes them to the vector store in bulk, reporting per-stage throughput.
+# Files parsed before (same bytes) are read from the page text cache instead of being extracted again.
+#
+# Usage:
+#   python ingest.py knowledge_base/
+#   python ingest.py "policies/**/*.pdf" --workers 16 --batch-size 128 --json report.json
+
+import argparse
+import glob
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from config import EMBED_BATCH_SIZE, INGEST_WORKERS, KNOWLEDGE_BASE_PATH, PAGES_PER_TASK, WRITE_BATCH_SIZE
+from embedding_manager import EmbeddingManager
+from page_cache import get_page_cache
+from pdf_extract import EXTRACTOR_VERSION, count_pages, extract_page_range
+
+
+class IngestInputError(ValueError):
+    """The inputs would overwrite each other or an existing knowledge base file"""
+
+
+def resolve_pdf_paths(inputs):
+    """Expand directories and glob patterns into a sorted list of PDF paths"""
+    paths = set()
+    for item in inputs:
+        if os.path.isdir(item):
+            matches = glob.glob(os.path.join(item, "*.pdf")) + glob.glob(os.path.join(item, "*.PDF"))
+        else:
+            matches = glob.glob(item, recursive=True)
+        paths.update(os.path.abspath(p) for p in matches if p.lower().endswith(".pdf") and os.path.isfile(p))
+    return sorted(paths)
+
+
+def check_inputs(paths, manager, copy_to=KNOWLEDGE_BASE_PATH, overwrite=False):
+    """Reject inputs that would clobber each other or the knowledge base; returns {path: content_hash}.
+
+    Documents are keyed by file name, so two inputs with the same name (e.g. from a "**" glob) would overwrite each
+    other's copy and registry entry. Copying over a knowledge base file with different bytes needs overwrite=True.
+    """
+    by_name = {}
+    for path in paths:
+        by_name.setdefault(os.path.basename(path), []).append(path)
+    duplicates = {name: found for name, found in by_name.items() if len(found) > 1}
+    if duplicates:
+        raise IngestInputError("Several inputs share a file name (documents are keyed by name): " + "; ".join(
+            f"{name}: {', '.join(found)}" for name, found in sorted(duplicates.items())))
+
+    hashes = {path: manager.file_hash(path) for path in paths}
+    if copy_to and not overwrite:
+        clashes = []
+        for path in paths:
+            target = os.path.join(copy_to, os.path.basename(path))
+            if (os.path.abspath(target) != os.path.abspath(path) and os.path.exists(target)
+                    and manager.file_hash(target) != hashes[path]):
+                clashes.append(os.path.basename(path))
+        if clashes:
+            raise IngestInputError(f"A different file with the same name is already in {copy_to}/ (pass overwrite=True / "
+                             f"--overwrite to replace it): {', '.join(sorted(clashes))}")
+    return hashes
+
+
+def extract_in_parallel(paths, workers=INGEST_WORKERS, pages_per_task=PAGES_PER_TASK):
+    """Extract every page of every PDF, splitting large files into page ranges across a process pool.
+
+    Returns ({path: [page texts]}, {path: error message}).
+    """
+    pages, errors = {}, {}
+    if workers <= 1:
+        for path in paths:
+            try:
+                pages[path] = extract_page_range(path)
+            except Exception as e:
+                errors[path] = str(e)
+        return pages, errors
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # Page counts first, so big documents can be fanned out over several workers
+        count_futures = {pool.submit(count_pages, path): path for path in paths}
+        range_futures = {}
+        for future in as_completed(count_futures):
+            path = count_futures[future]
+            try:
+                n_pages = future.result()
+            except Exception as e:
+                errors[path] = str(e)
+                continue
+            pages[path] = [""] * n_pages
+            for start in range(0, n_pages, pages_per_task):
+                stop = min(n_pages, start + pages_per_task)
+                range_futures[pool.submit(extract_page_range, path, start, stop)] = (path, start)
+
+        for future in as_completed(range_futures):
+            path, start = range_futures[future]
+            try:
+                texts = future.result()
+            except Exception as e:
+                errors[path] = str(e)
+                continue
+            pages[path][start:start + len(texts)] = texts
+
+    for path in errors:
+        pages.pop(path, None)
+    return pages, errors
+
+
+def ingest(paths, manager, workers=INGEST_WORKERS, batch_size=EMBED_BATCH_SIZE,
+           write_batch_size=WRITE_BATCH_SIZE, copy_to=KNOWLEDGE_BASE_PATH, page_cache=None, overwrite=False):
+    """Bulk-ingest PDFs into the vector store and return a report with per-stage throughput.
+
+    Raises IngestInputError (before anything is copied or indexed) if inputs share a file name, or would replace a
+    different knowledge base file without overwrite=True.
+    """
+    total_started = time.perf_counter()
+    hashes = check_inputs(paths, manager, copy_to, overwrite)
+
+    # --- Stage 0: copy into the knowledge base (so the admin panel and folder sync see them) + skip unchanged ---
+    if copy_to:
+        os.makedirs(copy_to, exist_ok=True)
+    pending, reports = [], []
+    for path in paths:
+        content_hash = hashes[path]
+        if copy_to and os.path.abspath(os.path.dirname(path)) != os.path.abspath(copy_to):
+            target = os.path.join(copy_to, os.path.basename(path))
+            shutil.copy2(path, target)
+            path = target
+        pdf_name = os.path.basename(path)
+        if manager.is_unchanged(pdf_name, content_hash):
+            reports.append(manager.unchanged_report(pdf_name))
+        else:
+            pending.append((path, pdf_name, content_hash))
+
+    # --- Stage 1: parallel page extraction (cached text for files parsed before) ---
+    started = time.perf_counter()
+    page_cache = page_cache or get_page_cache()
+    cached, to_extract = {}, []
+    for path, _, content_hash in pending:
+        hit = page_cache.get(content_hash, EXTRACTOR_VERSION)
+        if hit is not None:
+            # Read now: the put() calls below may evict this file before index_documents gets to it
+            cached[path] = list(hit)
+        else:
+            to_extract.append((path, content_hash))
+    pages, errors = extract_in_parallel([path for path, _ in to_extract], workers=workers)
+    for path, content_hash in to_extract:
+        if path in pages:
+            page_cache.put(content_hash, EXTRACTOR_VERSION, pages[path])
+    extract_seconds = time.perf_counter() - started
+    n_pages = sum(len(p) for p in pages.values())
+    n_cached = sum(len(p) for p in cached.values())
+    pages.update(cached)
+
+    for path, error in errors.items():
+        print(f"❌ Failed to extract {os.path.basename(path)}: {error}")
+        reports.append({"status": "failed", "pdf": os.path.basename(path), "error": error})
+
+    # --- Stages 2-4: plan, batch-encode, bulk write ---
+    documents = [(pdf_name, content_hash, pages[path]) for path, pdf_name, content_hash in pending if path in pages]
+    timings = {"plan": 0.0, "embed": 0.0, "write": 0.0}
+    if documents:
+        doc_reports, timings = manager.index_documents(documents, batch_size=batch_size,
+                                                       write_batch_size=write_batch_size)
+        reports.extend(doc_reports)
+
+    n_chunks = sum(r.get("chunks_added", 0) for r in reports)
+    total_seconds = time.perf_counter() - total_started
+    return {
+        "files": len(paths),
+        "unchanged": sum(r["status"] == "unchanged" for r in reports),
+        "failed": len(errors),
+        "pages_extracted": n_pages,
+        "pages_cached": n_cached,
+        "chunks_embedded": n_chunks,
+        "chunks_removed": sum(r.get("chunks_removed", 0) for r in reports),
+        "stages": {
+            "extract": {"seconds": extract_seconds, "pages_per_s": _rate(n_pages, extract_seconds)},
+            "plan": {"seconds": timings["plan"]},
+            "embed": {"seconds": timings["embed"], "chunks_per_s": _rate(n_chunks, timings["embed"])},
+            "write": {"seconds": timings["write"], "chunks_per_s": _rate(n_chunks, timings["write"])},
+            "total": {"seconds": total_seconds},
+        },
+        "documents": reports,
+    }
+
+
+def _rate(count, seconds):
+    return round(count / seconds, 1) if seconds > 0 else None
+
+
+def print_report(report):
+    stages = report["stages"]
+    print(f"\n📦 {report['files']} files: {report['unchanged']} unchanged, {report['failed']} failed")
+    print(f"   extract : {report['pages_extracted']:>7} pages  in {stages['extract']['seconds']:7.2f}s "
+          f"({stages['extract']['pages_per_s']} pages/s), {report['pages_cached']} from cache")
+    print(f"   embed   : {report['chunks_embedded']:>7} chunks in {stages['embed']['seconds']:7.2f}s "
+          f"({stages['embed']['chunks_per_s']} chunks/s)")
+    print(f"   write   : {report['chunks_embedded']:>7} chunks in {stages['write']['seconds']:7.2f}s "
+          f"({stages['write']['chunks_per_s']} chunks/s), {report['chunks_removed']} removed")
+    print(f"   total   : {stages['total']['seconds']:.2f}s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk-ingest policy PDFs into the EchoPal vector store.")
+    parser.add_argument("inputs", nargs="+", help="PDF files, directories or glob patterns (quote globs)")
+    parser.add_argument("--workers", type=int, default=INGEST_WORKERS, help="processes for page extraction")
+    parser.add_argument("--batch-size", type=int, default=EMBED_BATCH_SIZE, help="chunks per encoder batch")
+    parser.add_argument("--write-batch-size", type=int, default=WRITE_BATCH_SIZE, help="rows per vector DB write")
+    parser.add_argument("--no-copy", action="store_true",
+                        help=f"don't copy the PDFs into {KNOWLEDGE_BASE_PATH}/ (folder sync will then treat them as removed)")
+    parser.add_argument("--overwrite", action="store_true",
+                        help=f"replace files in {KNOWLEDGE_BASE_PATH}/ that have the same name but different bytes")
+    parser.add_argument("--json", metavar="PATH", help="also write the report as JSON")
+    args = parser.parse_args(argv)
+
+    paths = resolve_pdf_paths(args.inputs)
+    if not paths:
+        parser.error("no PDF files matched")
+
+    manager = EmbeddingManager()
+    try:
+        report = ingest(paths, manager, workers=args.workers, batch_size=args.batch_size,
+                        write_batch_size=args.write_batch_size, copy_to=None if args.no_copy else KNOWLEDGE_BASE_PATH,
+                        overwrite=args.overwrite)
+    except IngestInputError as e:
+        parser.error(str(e))
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+# ingest_jobs.py = background ingestion for the admin panel. Uploads enqueue a job, a worker thread indexes it with the
+# shared EmbeddingManager, and job state/progress is persisted in SQLite so every session (and a restart) can see it.
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+
+from config import JOBS_DB_PATH
+from embedding_manager import get_shared_manager
+
+# Job lifecycle
+QUEUED, EXTRACTING, EMBEDDING, DONE, FAILED = "queued", "extracting", "embedding", "done", "failed"
+ACTIVE_STATES = (QUEUED, EXTRACTING, EMBEDDING)
+
+_COLUMNS = ("id", "pdf_name", "file_path", "content_hash", "state", "pages_done", "pages_total",
+            "chunks_done", "chunks_total", "error", "report", "created_at", "updated_at")
+
+
+def job_id_for(pdf_name, content_hash):
+    """Same file name + same bytes -> same job, so Streamlit reruns never enqueue duplicate work"""
+    return hashlib.sha256(f"{pdf_name}\0{content_hash}".encode("utf-8")).hexdigest()[:16]
+
+
+class IngestJobQueue:
+    def __init__(self, db_path=JOBS_DB_PATH, manager_factory=get_shared_manager, progress_interval=0.5):
+        self.db_path = db_path
+        self.manager_factory = manager_factory
+        self.progress_interval = progress_interval
+        self._wake = threading.Event()
+        self._worker = None
+        self._start_lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        with self._connect() as conn, conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    pdf_name TEXT NOT NULL,
+                    file_path TEXT NOT NULL,
+                    content_hash TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    pages_done INTEGER DEFAULT 0,
+                    pages_total INTEGER DEFAULT 0,
+                    chunks_done INTEGER DEFAULT 0,
+                    chunks_total INTEGER DEFAULT 0,
+                    error TEXT,
+                    report TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )""")
+            # Jobs that were running when the server stopped are picked up again
+            conn.execute("UPDATE jobs SET state = ? WHERE state IN (?, ?)", (QUEUED, EXTRACTING, EMBEDDING))
+
+    def _connect(self):
+        return closing(sqlite3.connect(self.db_path, timeout=30))
+
+    # --- Public API ---
+    def enqueue(self, file_path, content_hash=None):
+        """Queue a PDF for indexing (idempotent) and return its job"""
+        pdf_name = os.path.basename(file_path)
+        if content_hash is None:
+            with open(file_path, "rb") as f:
+                content_hash = hashlib.sha256(f.read()).hexdigest()
+        job_id = job_id_for(pdf_name, content_hash)
+        now = time.time()
+
+        with self._connect() as conn:
+            row = conn.execute("SELECT state FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        state = row[0] if row else None
+        # Retry a failed upload of the same file. A finished job is re-run when another version of the file has been
+        # indexed since (upload v1, v2, then v1 again); index_pdf() skips the file if nothing actually changed.
+        requeue = state == FAILED or (state == DONE and
+                                      not self.manager_factory().is_unchanged(pdf_name, content_hash))
+
+        with self._connect() as conn, conn:
+            if state is None:
+                conn.execute(
+                    "INSERT OR IGNORE INTO jobs (id, pdf_name, file_path, content_hash, state, created_at, "
+                    "updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (job_id, pdf_name, file_path, content_hash, QUEUED, now, now))
+            elif requeue:
+                conn.execute(
+                    "UPDATE jobs SET state = ?, file_path = ?, error = NULL, report = NULL, pages_done = 0, "
+                    "chunks_done = 0, updated_at = ? WHERE id = ? AND state IN (?, ?)",
+                    (QUEUED, file_path, now, job_id, DONE, FAILED))
+
+        self.start()
+        self._wake.set()
+        return self.get(job_id)
+
+    def get(self, job_id):
+        with self._connect() as conn:
+            row = conn.execute(f"SELECT {', '.join(_COLUMNS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return _row_to_job(row) if row else None
+
+    def list_jobs(self, limit=20):
+        """Most recently updated jobs first"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM jobs ORDER BY updated_at DESC LIMIT ?", (limit,)).fetchall()
+        return [_row_to_job(row) for row in rows]
+
+    def has_active_jobs(self):
+        with self._connect() as conn:
+            row = conn.execute(
+                f"SELECT COUNT(*) FROM jobs WHERE state IN ({', '.join('?' * len(ACTIVE_STATES))})",
+                ACTIVE_STATES).fetchone()
+        return row[0] > 0
+
+    def forget(self, pdf_name):
+        """Drop finished jobs for a deleted document so uploading it again re-indexes it"""
+        with self._connect() as conn, conn:
+            conn.execute("DELETE FROM jobs WHERE pdf_name = ? AND state IN (?, ?)", (pdf_name, DONE, FAILED))
+
+    def start(self):
+        """Start the background worker thread (once per process)"""
+        with self._start_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._worker_loop, name="echopal-ingest", daemon=True)
+                self._worker.start()
+
+    # --- Worker ---
+    def _worker_loop(self):
+        while True:
+            job = self._claim_next()
+            if job is None:
+                self._wake.wait(timeout=5)
+                self._wake.clear()
+                continue
+            self._run(job)
+
+    def _claim_next(self):
+        with self._connect() as conn, conn:
+            row = conn.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM jobs WHERE state = ? ORDER BY created_at LIMIT 1",
+                (QUEUED,)).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE jobs SET state = ?, updated_at = ? WHERE id = ?", (EXTRACTING, time.time(), row[0]))
+        return _row_to_job(row)
+
+    def _run(self, job):
+        last_write = [0.0]
+
+        def progress(stage, done, total):
+            # Throttle DB writes; always record the final tick of a stage
+            now = time.time()
+            if done != total and now - last_write[0] < self.progress_interval:
+                return
+            last_write[0] = now
+            if stage == "extracting":
+                self._update(job["id"], state=EXTRACTING, pages_done=done, pages_total=total)
+            else:
+                self._update(job["id"], state=EMBEDDING, chunks_done=done, chunks_total=total)
+
+        try:
+            if not os.path.exists(job["file_path"]):
+                raise FileNotFoundError(f"{job['pdf_name']} was removed before it could be indexed")
+            report = self.manager_factory().index_pdf(job["file_path"], progress=progress)
+        except Exception as e:
+            print(f"❌ Ingest job {job['id']} ({job['pdf_name']}) failed: {e}")
+            self._update(job["id"], state=FAILED, error=str(e))
+        else:
+            self._update(job["id"], state=DONE, report=json.dumps(report))
+
+    def _update(self, job_id, **fields):
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._connect() as conn, conn:
+            conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+
+def _row_to_job(row):
+    job = dict(zip(_COLUMNS, row))
+    job["report"] = json.loads(job["report"]) if job["report"] else None
+    return job
+
+
+# --- Process-wide shared queue (one worker thread per server process) ---
+_shared_queue = None
+_shared_queue_lock = threading.Lock()
+
+
+def get_job_queue():
+    global _shared_queue
+    with _shared_queue_lock:
+        if _shared_queue is None:
+            _shared_queue = IngestJobQueue()
+            _shared_queue.start()
+    return _shared_queue
@@ -0,0 +1,58 @@
+# knowledge_sync.py = incremental sync of the knowledge_base folder into the vector store. Unchanged files are skipped
+# by content hash, new/changed files are indexed by background ingest jobs (which only re-embed changed chunks), and
+# documents whose file is gone are removed. The per-document report is built from those jobs as they finish.
+
+import os
+
+from config import KNOWLEDGE_BASE_PATH
+
+
+def list_pdfs(folder=KNOWLEDGE_BASE_PATH):
+    """PDF file names in the knowledge base folder"""
+    if not os.path.isdir(folder):
+        return []
+    return sorted(name for name in os.listdir(folder) if name.lower().endswith(".pdf"))
+
+
+def plan_sync(manager, folder=KNOWLEDGE_BASE_PATH):
+    """What a sync would touch, without embedding anything: new/changed PDFs as [(path, content_hash)], the names of
+    unchanged ones, and indexed sources whose file is gone"""
+    files = list_pdfs(folder)
+    changed, unchanged = [], []
+    for name in files:
+        path = os.path.join(folder, name)
+        content_hash = manager.file_hash(path)
+        if manager.is_unchanged(name, content_hash):
+            unchanged.append(name)
+        else:
+            changed.append((path, content_hash))
+    orphans = sorted(set(manager.registry.sources()) - set(files))
+    return {"changed": changed, "unchanged": unchanged, "orphans": orphans}
+
+
+def sync_report(jobs, unchanged=(), removed=()):
+    """Diff report of a sync from its ingest jobs: finished jobs contribute their index_pdf() report, failed ones
+    their error, and jobs still running their current state"""
+    documents = []
+    for job in jobs:
+        if job["state"] == "done" and job["report"]:
+            documents.append(job["report"])
+        elif job["state"] == "failed":
+            documents.append({"status": "failed", "pdf": job["pdf_name"], "error": job["error"]})
+        else:
+            documents.append({"status": job["state"], "pdf": job["pdf_name"]})
+    documents.extend(unchanged)
+    return {"documents": documents, "removed": list(removed), "summary": summarize(documents, removed)}
+
+
+def summarize(documents, removed=()):
+    """Totals over per-document reports"""
+    summary = {status: 0 for status in ("added", "updated", "unchanged", "failed")}
+    for report in documents:
+        summary[report["status"]] = summary.get(report["status"], 0) + 1
+    summary["removed"] = len(removed)
+    summary["chunks_added"] = sum(r.get("chunks_added", 0) for r in documents)
+    summary["chunks_removed"] = (sum(r.get("chunks_removed", 0) for r in documents)
+                                 + sum(r.get("deleted_chunks", 0) for r in removed))
+    summary["chunks_kept"] = sum(r.get("chunks_kept", 0) for r in documents)
+    return summary
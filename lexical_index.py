@@ -0,0 +1,158 @@
+# lexical_index.py = BM25 keyword index kept next to the vectors. Dense search misses exact policy terms (clause numbers
+# like "10.49", acronyms like "TRMF", regulation names); this inverted index finds them. It is updated incrementally
+# with every ingest/delete and persisted as JSON in the vector store folder.
+
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+
+from config import BM25_K1, BM25_B
+
+# Clause/paragraph numbers ("10.49", "2.3.1") stay one token; everything else splits on non-word characters
+TOKEN_RE = re.compile(r"\d+(?:\.\d+)+|\w+")
+STOPWORDS = frozenset("""
+a an and are as at be by can do does for from has have how i if in is it its may must of on or should
+that the their there these this to under was what when where which who why will with within would you your
+""".split())
+
+
+def tokenize(text):
+    """Lower-cased terms without stopwords; a light plural strip so "providers" matches "provider" """
+    terms = []
+    for token in TOKEN_RE.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        if len(token) > 4 and token.isalpha() and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        terms.append(token)
+    return terms
+
+
+class LexicalIndex:
+    def __init__(self, path, k1=BM25_K1, b=BM25_B):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+        self._docs = {}        # chunk id -> {"source": ..., "tf": {term: count}, "length": n}
+        self._postings = {}    # term -> {chunk id: count}
+        self._total_length = 0
+        self._mtime = None
+        self._reload_if_changed()
+
+    def _reload_if_changed(self):
+        """Pick up writes from other processes (e.g. the bulk ingest CLI), like the document registry"""
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return
+        if mtime != self._mtime:
+            with open(self.path, "r", encoding="utf-8") as f:
+                docs = json.load(f)
+            with self._lock:
+                self._docs, self._postings, self._total_length = {}, {}, 0
+                for chunk_id, doc in docs.items():
+                    self._index(chunk_id, doc)
+                self._mtime = mtime
+
+    def exists_on_disk(self):
+        return os.path.exists(self.path)
+
+    def __len__(self):
+        return len(self._docs)
+
+    # --- Updates ---
+    def add(self, chunks):
+        """Index (or re-index) chunks given as (chunk_id, text, source) tuples"""
+        with self._lock:
+            for chunk_id, text, source in chunks:
+                self._unindex(chunk_id)
+                terms = tokenize(text)
+                self._index(chunk_id, {"source": source, "tf": dict(Counter(terms)), "length": len(terms)})
+
+    def remove(self, chunk_ids):
+        with self._lock:
+            for chunk_id in chunk_ids:
+                self._unindex(chunk_id)
+
+    def remove_source(self, source):
+        """Drop every chunk of a document; returns how many were indexed"""
+        with self._lock:
+            chunk_ids = [chunk_id for chunk_id, doc in self._docs.items() if doc["source"] == source]
+            for chunk_id in chunk_ids:
+                self._unindex(chunk_id)
+        return len(chunk_ids)
+
+    def rebuild_from_collection(self, collection, page_size=5000):
+        """Index every chunk already in Chroma (stores created before the lexical index existed)"""
+        with self._lock:
+            self._docs, self._postings, self._total_length = {}, {}, 0
+        offset = 0
+        while True:
+            items = collection.get(include=["documents", "metadatas"], limit=page_size, offset=offset)
+            if not items["ids"]:
+                break
+            self.add((chunk_id, text or "", (meta or {}).get("source"))
+                     for chunk_id, text, meta in zip(items["ids"], items["documents"], items["metadatas"]))
+            offset += len(items["ids"])
+        self.save()
+        return len(self._docs)
+
+    def save(self):
+        # Write to a temp file then swap, so a crash never leaves a half-written index
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._docs, f, separators=(",", ":"))
+            os.replace(tmp_path, self.path)
+            self._mtime = os.path.getmtime(self.path)
+
+    # --- Query ---
+    def search(self, query, top_k=20):
+        """Return [(chunk_id, bm25_score, coverage)] best first.
+
+        coverage = score / sum of the query terms' idf, clipped to 1: roughly the share of the (idf-weighted)
+        query a chunk contains, which unlike raw BM25 is comparable across queries and usable as a threshold.
+        """
+        self._reload_if_changed()
+        terms = tokenize(query)
+        with self._lock:
+            n_docs = len(self._docs)
+            if not terms or not n_docs:
+                return []
+            avg_length = self._total_length / n_docs
+            scores = {}
+            max_score = 0.0
+            for term, query_count in Counter(terms).items():
+                postings = self._postings.get(term, {})
+                idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                max_score += idf * query_count
+                for chunk_id, tf in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * self._docs[chunk_id]["length"] / avg_length)
+                    scores[chunk_id] = scores.get(chunk_id, 0.0) + query_count * idf * tf * (self.k1 + 1) / (tf + norm)
+
+        best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+        return [(chunk_id, score, min(1.0, score / max_score)) for chunk_id, score in best]
+
+    # --- internals (call with the lock held) ---
+    def _index(self, chunk_id, doc):
+        self._docs[chunk_id] = doc
+        self._total_length += doc["length"]
+        for term, count in doc["tf"].items():
+            self._postings.setdefault(term, {})[chunk_id] = count
+
+    def _unindex(self, chunk_id):
+        doc = self._docs.pop(chunk_id, None)
+        if doc is None:
+            return
+        self._total_length -= doc["length"]
+        for term in doc["tf"]:
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(chunk_id, None)
+                if not postings:
+                    del self._postings[term]
@@ -0,0 +1,184 @@
+# page_cache.py = on-disk cache of extracted PDF page text, keyed by file content hash + extractor version. Layout
+# extraction is the slowest ingest stage; with this cache, re-adding a deleted document, changing chunk settings or
+# switching vector stores re-chunks from cached text instead of parsing the PDF again.
+#
+# One file per document: a small header, an offset table, then every page zlib-compressed on its own, so a single
+# page can be read (or all pages streamed) without inflating the rest. Least recently used files are evicted once the
+# cache outgrows its size cap. Stdlib only, so ingest worker processes can use it cheaply.
+
+import os
+import struct
+import threading
+import time
+import zlib
+
+from config import PAGE_CACHE_PATH, PAGE_CACHE_MAX_MB
+from telemetry import get_metrics
+
+MAGIC = b"EPPC"
+FORMAT_VERSION = 1
+_HEADER = struct.Struct("<4sHI")  # magic, format version, page count
+_ENTRY = struct.Struct("<QI")     # page offset, compressed length
+
+
+class CachedPages:
+    """Read-only, lazily loaded sequence of a document's page texts"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            magic, version, n_pages = _HEADER.unpack(f.read(_HEADER.size))
+            if magic != MAGIC or version != FORMAT_VERSION:
+                raise ValueError(f"Not a page cache file: {path}")
+            table = f.read(_ENTRY.size * n_pages)
+        self._entries = [_ENTRY.unpack_from(table, i * _ENTRY.size) for i in range(n_pages)]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(self.iter_pages(*index.indices(len(self))[:2]))
+        offset, length = self._entries[index]
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            return zlib.decompress(f.read(length)).decode("utf-8")
+
+    def __iter__(self):
+        return self.iter_pages()
+
+    def iter_pages(self, start=0, stop=None):
+        """Stream pages [start, stop) one at a time, reading the file once"""
+        with open(self.path, "rb") as f:
+            for offset, length in self._entries[start:stop]:
+                f.seek(offset)
+                yield zlib.decompress(f.read(length)).decode("utf-8")
+
+
+class PageCache:
+    def __init__(self, folder=PAGE_CACHE_PATH, max_bytes=int(PAGE_CACHE_MAX_MB * 1024 * 1024)):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._counts = {"hits": 0, "misses": 0, "writes": 0, "evicted": 0}
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def _path(self, content_hash, extractor):
+        return os.path.join(self.folder, content_hash[:2], f"{content_hash}.{extractor}.pages")
+
+    def get(self, content_hash, extractor):
+        """Cached pages for this file content and extractor, or None"""
+        if not self.enabled:
+            return None
+        path = self._path(content_hash, extractor)
+        try:
+            pages = CachedPages(path)
+            # Reads refresh the mtime, which is what eviction orders by
+            os.utime(path)
+        except (OSError, ValueError, struct.error):
+            with self._lock:
+                self._counts["misses"] += 1
+            return None
+        with self._lock:
+            self._counts["hits"] += 1
+        return pages
+
+    def put(self, content_hash, extractor, pages):
+        """Store a document's page texts; returns the file size in bytes"""
+        if not self.enabled:
+            return 0
+        path = self._path(content_hash, extractor)
+        blobs = [zlib.compress(text.encode("utf-8"), 6) for text in pages]
+        offset = _HEADER.size + _ENTRY.size * len(blobs)
+        table = bytearray()
+        for blob in blobs:
+            table += _ENTRY.pack(offset, len(blob))
+            offset += len(blob)
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Unique temp name: ingest workers may write the same document at once
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, len(blobs)))
+            f.write(table)
+            for blob in blobs:
+                f.write(blob)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._counts["writes"] += 1
+        self.evict()
+        return offset
+
+    def evict(self):
+        """Delete least recently used files until the cache fits in max_bytes"""
+        files = self._files()
+        total = sum(size for _, size, _ in files)
+        evicted = 0
+        for path, size, _ in sorted(files, key=lambda item: item[2]):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            evicted += 1
+        if evicted:
+            with self._lock:
+                self._counts["evicted"] += evicted
+        return evicted
+
+    def clear(self):
+        for path, _, _ in self._files():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self):
+        files = self._files()
+        with self._lock:
+            return {**self._counts, "documents": len(files), "bytes": sum(size for _, size, _ in files),
+                    "max_bytes": self.max_bytes}
+
+    def _files(self):
+        """[(path, size, mtime)] of every cached document"""
+        files = []
+        if not os.path.isdir(self.folder):
+            return files
+        stale_before = time.time() - 3600
+        for root, _, names in os.walk(self.folder):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                if name.endswith(".pages"):
+                    files.append((path, stat.st_size, stat.st_mtime))
+                elif name.endswith(".tmp") and stat.st_mtime < stale_before:
+                    # Left behind by a crashed writer
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+        return files
+
+
+# --- Process-wide default cache ---
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+
+def get_page_cache():
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            cache = PageCache()
+            get_metrics().register_gauge(
+                "echopal_page_cache_bytes", lambda: cache.stats()["bytes"], "Size of the extracted page text cache")
+            _shared_cache = cache
+    return _shared_cache
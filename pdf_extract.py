@@ -0,0 +1,46 @@
+# pdf_extract.py = page-level PDF text extraction with pdfplumber. Kept free of model/vector-store imports so it can
+# run cheaply inside worker processes of the bulk ingestion pool.
+
+import pdfplumber
+
+from page_cache import get_page_cache
+
+# Part of the page cache key: bump the suffix when extraction changes so cached text from the old logic is not reused
+EXTRACTOR_VERSION = f"pdfplumber-{pdfplumber.__version__}-r1"
+
+
+def count_pages(pdf_path):
+    """Number of pages in a PDF"""
+    with pdfplumber.open(pdf_path) as pdf:
+        return len(pdf.pages)
+
+
+def extract_page_range(pdf_path, start=0, stop=None, on_page=None):
+    """Extract the text of pages [start, stop) (empty string for pages without text).
+
+    on_page(done, total) is called after each page, for progress reporting.
+    """
+    with pdfplumber.open(pdf_path) as pdf:
+        pages = pdf.pages[start:stop]
+        texts = []
+        for page in pages:
+            texts.append(page.extract_text() or "")
+            if on_page:
+                on_page(len(texts), len(pages))
+        return texts
+
+
+def extract_document(pdf_path, content_hash=None, on_page=None, cache=None):
+    """Text of every page, read from the page cache when this exact file (content_hash) was parsed before"""
+    cache = cache or get_page_cache()
+    if content_hash:
+        cached = cache.get(content_hash, EXTRACTOR_VERSION)
+        if cached is not None:
+            if on_page:
+                on_page(len(cached), len(cached))
+            # In memory, so a put() elsewhere (another upload, the bulk CLI) can't evict it before it is chunked
+            return list(cached)
+    texts = extract_page_range(pdf_path, on_page=on_page)
+    if content_hash:
+        cache.put(content_hash, EXTRACTOR_VERSION, texts)
+    return texts
@@ -0,0 +1,232 @@
+# prompt_builder.py = token-budgeted prompt assembly for EchoPal's answers. Retrieved chunks are deduplicated
+# (neighbouring chunks overlap, so sentences repeat) and packed into a fixed context budget, whole while they fit
+# and trimmed to the sentences that match the question once they don't. A compact summary of the recent conversation
+# is added, so follow-up questions keep their meaning while the prompt (and the LLM's prefill time) stays bounded
+# however long the chat gets.
+
+import math
+import re
+
+from chunker import SENTENCE_END_RE, approximate_token_count
+from config import PROMPT_CONTEXT_TOKENS, PROMPT_HISTORY_TOKENS, PROMPT_HISTORY_MESSAGES, PROMPT_MIN_SENTENCE_SCORE
+from lexical_index import tokenize
+
+REFUSAL = "Apologies, I couldn't answer your query as it is outside my knowledge base."
+
+# Questions that lean on the previous turn. Either they open with a connective ("And what about IaaS?", "What if
+# the provider is offshore?"), or a pronoun stands in for their subject and little else is said ("How often must it be
+# reviewed?"). A question that names its own subject ("Is there a limit on outsourcing to cloud providers?") is not.
+FOLLOW_UP_RE = re.compile(r"^\s*(and|but|also|so|then|what about|how about|what if)\b", re.I)
+REFERENT_RE = re.compile(r"\b(it|its|this|that|these|those|they|them|same|above)\b", re.I)
+REFERENT_WORDS = {"they", "them", "those", "same", "above"}  # pronouns the BM25 tokenizer keeps
+FOLLOW_UP_MAX_TERMS = 2  # content words a pronoun question may have and still lack a subject of its own
+CLAUSE_MARKER_RE = re.compile(r"^(\d+(\.\d+)*\.?|\(?[a-z]{1,4}\))$", re.I)
+
+USER_TURN_TOKENS = 40       # per earlier question in the summary
+ASSISTANT_TURN_TOKENS = 60  # per earlier answer (its opening sentences)
+
+
+def count_tokens(text):
+    """Approximate Llama token count (words + punctuation marks; slightly over-counts, which is the safe side)"""
+    return approximate_token_count(text)
+
+
+def split_sentences(text):
+    """Sentences of a chunk, with bare clause numbers ("2.", "10.49") kept on the sentence they introduce"""
+    sentences, marker = [], ""
+    for sentence in SENTENCE_END_RE.split(" ".join(text.split())):
+        if CLAUSE_MARKER_RE.match(sentence):
+            marker = f"{marker} {sentence}".strip()
+        elif sentence:
+            sentences.append(f"{marker} {sentence}".strip())
+            marker = ""
+    if marker:
+        sentences.append(marker)
+    return sentences
+
+
+def is_follow_up(prompt):
+    if FOLLOW_UP_RE.search(prompt):
+        return True
+    terms = [term for term in tokenize(prompt) if term not in REFERENT_WORDS]
+    # A bare "Why?" says nothing retrieval could use on its own
+    return not terms or (bool(REFERENT_RE.search(prompt)) and len(terms) <= FOLLOW_UP_MAX_TERMS)
+
+
+def retrieval_query(prompt, history):
+    """What to search for: a short follow-up is joined to the previous question so retrieval sees its subject"""
+    previous = next((m["content"] for m in reversed(history) if m["role"] == "user"), None)
+    if previous and is_follow_up(prompt):
+        return f"{previous} {prompt}"
+    return prompt
+
+
+def truncate_tokens(text, max_tokens):
+    """Whole sentences up to max_tokens; the first sentence is cut word by word if it alone is too long"""
+    kept, used = [], 0
+    for sentence in split_sentences(text):
+        tokens = count_tokens(sentence)
+        if used + tokens > max_tokens:
+            if not kept:
+                return _cut_words(sentence, max_tokens)
+            break
+        kept.append(sentence)
+        used += tokens
+    return " ".join(kept)
+
+
+def _cut_words(text, max_tokens):
+    words, used = [], 0
+    for word in text.split():
+        used += count_tokens(word)
+        if used > max_tokens and words:
+            break
+        words.append(word)
+    return " ".join(words) + " …"
+
+
+def summarize_history(history, max_tokens=PROMPT_HISTORY_TOKENS, max_messages=PROMPT_HISTORY_MESSAGES):
+    """Compact transcript of the latest turns (questions shortened, answers cut to their opening sentences),
+    newest kept first when the budget runs out. Extractive, so it costs no extra LLM call."""
+    lines, used = [], 0
+    for message in reversed(history[-max_messages:] if max_messages else []):
+        if message["role"] == "user":
+            line = "User: " + truncate_tokens(message["content"], USER_TURN_TOKENS)
+        else:
+            line = "EchoPal: " + truncate_tokens(message["content"].replace("**", ""), ASSISTANT_TURN_TOKENS)
+        tokens = count_tokens(line)
+        if used + tokens > max_tokens:
+            break
+        lines.append(line)
+        used += tokens
+    return "\n".join(reversed(lines))
+
+
+def _terms(text):
+    """Query-matching terms: the BM25 tokens, cut to 6 letters so "reviewed" meets "review" """
+    return {t[:6] if t.isalpha() else t for t in tokenize(text)}
+
+
+def _normalize(sentence):
+    return " ".join(re.sub(r"[^\w\s.]", " ", sentence.lower()).split())
+
+
+def pack_context(query, hits, max_tokens=PROMPT_CONTEXT_TOKENS, min_score=PROMPT_MIN_SENTENCE_SCORE):
+    """Fit the retrieved hits (best first) into max_tokens.
+
+    Repeated sentences are dropped. Chunks are then kept whole, in retrieval order, while they fit; an answer often
+    sits in a sentence that shares no words with the question ("This must happen at least once every three years.").
+    Only the chunks that no longer fit are trimmed: their sentences are scored by the query terms they contain,
+    weighted by how rare they are among the candidates (a word every chunk shares, like "cloud", says little), those
+    scoring at least min_score x the best one are packed best first, and any budget left is filled in retrieval order.
+    """
+    query_terms = _terms(query)
+    split = [[(text, _normalize(text)) for text in split_sentences(hit["text"])] for hit in hits]
+    all_keys = {key for sentences in split for _, key in sentences}
+    seen = set()
+    chunks, duplicates = [], 0
+    for hit, pairs in zip(hits, split):
+        sentences = []
+        for text, key in pairs:
+            # Exact repeats, and fragments of a longer sentence found in any hit (chunk overlap cuts sentences)
+            if not key or key in seen or (len(key) >= 20 and any(key in other for other in all_keys
+                                                                 if len(other) > len(key))):
+                duplicates += 1
+                continue
+            seen.add(key)
+            sentences.append({"text": text, "tokens": count_tokens(text), "terms": _terms(text) & query_terms})
+        header = f"From {hit['source']}" + (f" (page {hit['page']})" if hit.get("page") else "") + ":"
+        chunks.append({"header": header, "header_tokens": count_tokens(header), "source": hit["source"],
+                       "sentences": sentences, "selected": set()})
+
+    candidates = [s for chunk in chunks for s in chunk["sentences"]]
+    df = {term: sum(1 for s in candidates if term in s["terms"]) for term in query_terms}
+    for sentence in candidates:
+        sentence["score"] = sum(math.log(1 + (len(candidates) - df[t] + 0.5) / (df[t] + 0.5))
+                                for t in sentence["terms"])
+    best = max((s["score"] for s in candidates), default=0.0)
+
+    used = 0
+
+    def take(c, i):
+        nonlocal used
+        chunk = chunks[c]
+        if i < 0 or i >= len(chunk["sentences"]) or i in chunk["selected"]:
+            return False
+        cost = chunk["sentences"][i]["tokens"] + (0 if chunk["selected"] else chunk["header_tokens"])
+        if used + cost > max_tokens:
+            return False
+        chunk["selected"].add(i)
+        used += cost
+        return True
+
+    # Whole chunks while the budget allows
+    rest = []
+    for c, chunk in enumerate(chunks):
+        cost = chunk["header_tokens"] + sum(s["tokens"] for s in chunk["sentences"])
+        if rest or not chunk["sentences"] or used + cost > max_tokens:
+            rest.append(c)
+            continue
+        chunk["selected"].update(range(len(chunk["sentences"])))
+        used += cost
+
+    # The rest is trimmed: matching sentences best first, then whatever still fits in retrieval order
+    matching = sorted(((chunks[c]["sentences"][i]["score"], -c, -i, c, i) for c in rest
+                       for i, s in enumerate(chunks[c]["sentences"]) if best > 0 and s["score"] >= min_score * best),
+                      reverse=True)
+    for *_, c, i in matching:
+        take(c, i)
+    for c in rest:
+        for i in range(len(chunks[c]["sentences"])):
+            take(c, i)
+
+    blocks, sources, used_sentences = [], [], 0
+    for chunk in chunks:
+        if not chunk["selected"]:
+            continue
+        parts, previous = [], None
+        for i in sorted(chunk["selected"]):
+            if previous is not None and i != previous + 1:
+                parts.append("…")
+            parts.append(chunk["sentences"][i]["text"])
+            previous = i
+        blocks.append(f"{chunk['header']} {' '.join(parts)}")
+        used_sentences += len(chunk["selected"])
+        if chunk["source"] not in sources:
+            sources.append(chunk["source"])
+
+    if not blocks and chunks and chunks[0]["sentences"]:
+        # Even the best sentence is over budget on its own: send a cut-down version rather than nothing
+        first = chunks[0]
+        text = _cut_words(first["sentences"][0]["text"], max(1, max_tokens - first["header_tokens"]))
+        blocks, sources, used_sentences = [f"{first['header']} {text}"], [first["source"]], 1
+        used = count_tokens(blocks[0])
+
+    return {"text": "\n\n".join(blocks), "tokens": used, "sources": sources, "sentences_used": used_sentences,
+            "sentences_trimmed": len(candidates) - used_sentences, "sentences_duplicate": duplicates}
+
+
+def assemble_prompt(prompt, hits, history=(), query=None, context_tokens=PROMPT_CONTEXT_TOKENS,
+                    history_tokens=PROMPT_HISTORY_TOKENS):
+    """Build the grounded prompt for `prompt` from the relevant hits and the earlier chat messages.
+
+    Returns {"prompt", "sources", "prompt_tokens", "context_tokens", "history_tokens", "sentences_*"}.
+    """
+    packed = pack_context(query or prompt, hits, max_tokens=context_tokens)
+    summary = summarize_history(list(history), max_tokens=history_tokens)
+    conversation = (f"Conversation so far (use it only to understand what the question refers to):\n{summary}\n\n"
+                    if summary else "")
+    text = (
+        "You are EchoPal, a policy assistant for a bank. "
+        "Answer the user's question *only* using the information in the context below. "
+        "Provide a **complete and well-explained answer**, covering all relevant reasons and implications mentioned in the context."
+        "If the answer cannot be found in the context, reply exactly: "
+        f"'{REFUSAL}'\n\n"
+        f"{conversation}"
+        f"Context:\n{packed['text']}\n\n"
+        f"Question: {prompt}\n\nAnswer:"
+    )
+    return {"prompt": text, "sources": packed["sources"], "prompt_tokens": count_tokens(text),
+            "context_tokens": packed["tokens"], "history_tokens": count_tokens(summary) if summary else 0,
+            "sentences_used": packed["sentences_used"], "sentences_trimmed": packed["sentences_trimmed"],
+            "sentences_duplicate": packed["sentences_duplicate"]}
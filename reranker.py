@@ -0,0 +1,42 @@
+# reranker.py = optional second-stage reranking. A small CPU cross-encoder reads (question, chunk) pairs together and
+# scores relevance far better than the bi-encoder distance, at the cost of one forward pass per candidate.
+# Enabled by setting ECHOPAL_RERANK_MODEL (e.g. cross-encoder/ms-marco-MiniLM-L-6-v2).
+
+import threading
+
+import numpy as np
+
+from config import RERANK_MODEL
+
+
+class CrossEncoderReranker:
+    def __init__(self, model_name=RERANK_MODEL):
+        # Imported here so the app doesn't pay for it when reranking is switched off
+        from sentence_transformers import CrossEncoder
+
+        self.model_name = model_name
+        self.model = CrossEncoder(model_name, device="cpu")
+
+    def score(self, query, texts, batch_size=16):
+        """Relevance of each text to the query as a 0-1 probability (sigmoid of the model's logit)"""
+        if not texts:
+            return np.empty(0, dtype=np.float32)
+        logits = np.asarray(self.model.predict([(query, text) for text in texts], batch_size=batch_size),
+                            dtype=np.float32)
+        return 1.0 / (1.0 + np.exp(-logits))
+
+
+# --- Process-wide shared reranker (None when reranking is off) ---
+_shared_reranker = None
+_shared_reranker_lock = threading.Lock()
+
+
+def get_reranker():
+    """Return the shared CrossEncoderReranker, or None if no rerank model is configured"""
+    global _shared_reranker
+    if not RERANK_MODEL:
+        return None
+    with _shared_reranker_lock:
+        if _shared_reranker is None:
+            _shared_reranker = CrossEncoderReranker()
+    return _shared_reranker
@@ -1,35 +1,84 @@
 # response_generator.py = defines a function that uses the Llama 3.1 model via Hugging Face’s Inference API to generate AI responses,
 # optionally enhanced with contextual information retrieved from a knowledge base.
+# Tokens can be streamed (sync generator or async generator) so the chat UI renders the answer as it arrives.
+# The LLM itself comes from generation_backend (HF Inference, an OpenAI-compatible server, or the offline stub).
 
 # Generation part from RAG
 
-from huggingface_hub import InferenceClient
+import time
 
-# Initialize Hugging Face Inference client with token
-client = InferenceClient(model="meta-llama/Llama-3.1-8B-Instruct")
+from config import GENERATION_MAX_TOKENS
+from generation_backend import get_backend
+from telemetry import inc, record_span
 
-def generate_response(prompt, context=None):
-    """
-    Generate a response using Llama Instruct.
-    If context is provided, prepend it to the prompt.
-    """
-    # Combine context with user prompt
+
+def build_messages(prompt, context=None):
+    """Combine context with user prompt"""
     if context:
         full_prompt = f"Answer the question using the following context:\n{context}\n\nQuestion: {prompt}"
     else:
         full_prompt = prompt
+    return [{"role": "user", "content": full_prompt}]
+
+
+def stream_response(prompt, context=None, cancel_event=None, stats=None, max_tokens=GENERATION_MAX_TOKENS):
+    """
+    Yield the response text piece by piece as Llama Instruct generates it.
+    Stops early (and closes the HTTP stream) once cancel_event is set.
+    If a dict is passed as stats it receives ttft_s, total_s, chunks and cancelled.
+    """
+    stats = stats if stats is not None else {}
+    stats.update(ttft_s=None, total_s=None, chunks=0, cancelled=False)
+    started = time.perf_counter()
 
-    full_response = ""
+    stream = get_backend().stream(build_messages(prompt, context), max_tokens=max_tokens, cancel_event=cancel_event)
+    try:
+        # Stream the response chunks as they arrive
+        for delta in stream:
+            if stats["ttft_s"] is None:
+                stats["ttft_s"] = time.perf_counter() - started
+            stats["chunks"] += 1
+            yield delta
+    finally:
+        stream.close()
+        stats["cancelled"] = cancel_event is not None and cancel_event.is_set()
+        stats["total_s"] = time.perf_counter() - started
+        _record_generation(stats, started)
 
-    # Stream the response chunks as they arrive
-    for chunk in client.chat_completion(
-            messages=[{"role": "user", "content": full_prompt}],
-            max_tokens=500,
-            stream=True
-    ):
-        delta = chunk.choices[0].delta.get("content", "")
-        if delta:
-            full_response += delta
 
-    return full_response
+async def astream_response(prompt, context=None, cancel_event=None, stats=None, max_tokens=GENERATION_MAX_TOKENS):
+    """Async variant of stream_response() for asyncio callers (many generations on one event loop)"""
+    stats = stats if stats is not None else {}
+    stats.update(ttft_s=None, total_s=None, chunks=0, cancelled=False)
+    started = time.perf_counter()
 
+    stream = get_backend().astream(build_messages(prompt, context), max_tokens=max_tokens, cancel_event=cancel_event)
+    try:
+        async for delta in stream:
+            if stats["ttft_s"] is None:
+                stats["ttft_s"] = time.perf_counter() - started
+            stats["chunks"] += 1
+            yield delta
+    finally:
+        await stream.aclose()
+        stats["cancelled"] = cancel_event is not None and cancel_event.is_set()
+        stats["total_s"] = time.perf_counter() - started
+        _record_generation(stats, started)
+
+
+def _record_generation(stats, started):
+    """Time to first token and full generation as telemetry spans of the current request"""
+    if stats["ttft_s"] is not None:
+        record_span("llm.ttft", stats["ttft_s"], started=started)
+    record_span("llm.generation", stats["total_s"], started=started, chunks=stats["chunks"],
+                cancelled=stats["cancelled"])
+    inc("echopal_llm_chunks_total", stats["chunks"])
+
+
+def generate_response(prompt, context=None):
+    """
+    Generate a response using Llama Instruct.
+    If context is provided, prepend it to the prompt.
+    Concurrent calls are micro-batched when the backend supports it.
+    """
+    return get_backend().complete(build_messages(prompt, context))
@@ -0,0 +1,109 @@
+# stub_server.py = local stand-in for an OpenAI-compatible LLM server, answering with EchoPal's deterministic stub
+# backend. Lets the app, load tests and the benchmark exercise the real HTTP/streaming path fully offline.
+#
+# Usage:
+#   python stub_server.py --port 8000 --ttft-ms 150 --tokens-per-s 40
+#   ECHOPAL_GENERATION_BACKEND=openai ECHOPAL_OPENAI_BASE_URL=http://localhost:8000/v1 streamlit run echoPal.py
+
+import argparse
+import json
+import re
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from generation_backend import StubBackend
+
+# Reverse of generation_backend.llama3_prompt(), for raw /completions prompts
+_TURN_RE = re.compile(r"<\|start_header_id\|>(\w+)<\|end_header_id\|>\n\n(.*?)<\|eot_id\|>", re.S)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    backend = StubBackend()
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self._send_json({"object": "list", "data": [{"id": self.backend.model, "object": "model"}]})
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        max_tokens = body.get("max_tokens", 500)
+        path = self.path.rstrip("/")
+
+        if path.endswith("/chat/completions"):
+            messages = body.get("messages", [])
+            if body.get("stream"):
+                self._stream_chat(messages, max_tokens)
+            else:
+                text = "".join(self.backend._open_stream(messages, max_tokens))
+                self._send_json({"object": "chat.completion", "model": self.backend.model,
+                                 "choices": [{"index": 0, "message": {"role": "assistant", "content": text},
+                                              "finish_reason": "stop"}]})
+        elif path.endswith("/completions"):
+            prompts = body.get("prompt", [])
+            prompts = [prompts] if isinstance(prompts, str) else prompts
+            batch = [[{"role": role, "content": content} for role, content in _TURN_RE.findall(p)]
+                     or [{"role": "user", "content": p}] for p in prompts]
+            texts = self.backend._complete_batch(batch, max_tokens)
+            self._send_json({"object": "text_completion", "model": self.backend.model,
+                             "choices": [{"index": i, "text": t, "finish_reason": "stop"} for i, t in enumerate(texts)]})
+        else:
+            self.send_error(404)
+
+    def _stream_chat(self, messages, max_tokens):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for delta in self.backend._open_stream(messages, max_tokens):
+                event = {"object": "chat.completion.chunk", "created": int(time.time()),
+                         "choices": [{"index": 0, "delta": {"content": delta}}]}
+                self._write_chunk(f"data: {json.dumps(event)}\n\n")
+            self._write_chunk("data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client cancelled the generation; nothing left to send
+            self.close_connection = True
+
+    def _write_chunk(self, text):
+        data = text.encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _send_json(self, payload):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass  # keep load tests quiet
+
+
+def serve(host="127.0.0.1", port=8000, ttft_ms=0, tokens_per_s=0):
+    StubHandler.backend = StubBackend(ttft_ms=ttft_ms, tokens_per_s=tokens_per_s)
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    server.daemon_threads = True
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="OpenAI-compatible stand-in LLM server for offline runs.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--ttft-ms", type=float, default=0, help="simulated time to first token")
+    parser.add_argument("--tokens-per-s", type=float, default=0, help="simulated decode speed (0 = instant)")
+    args = parser.parse_args(argv)
+
+    server = serve(args.host, args.port, args.ttft_ms, args.tokens_per_s)
+    print(f"🤖 Stub LLM server on http://{args.host}:{args.port}/v1")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,331 @@
+# telemetry.py = tracing and metrics for EchoPal's chat pipeline. Every chat request runs inside a trace with its own
+# id. The timed spans (embed, answer cache, retrieval stages, filter, prompt build, time to first token, generation)
+# feed per-stage latency histograms, counters track outcomes, and gauges report cache sizes and index size on demand.
+# Everything can be read as Prometheus text or as JSON. Finished traces can also be logged as JSON lines, and an
+# optional /metrics endpoint serves the same data. Stdlib only, so any module can import it cheaply.
+#
+# Usage:
+#   with trace("chat") as t:             # t.id tags the request's log lines
+#       with span("embed"):
+#           ...
+#       record_span("llm.ttft", seconds)  # durations measured elsewhere
+#       annotate(hits=[...])              # structured details for the trace's JSON log line
+#       inc("echopal_requests_total", outcome="answered")
+
+import contextvars
+import json
+import math
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from config import TELEMETRY_LOG, TELEMETRY_PORT, TELEMETRY_SAMPLES
+
+# Prometheus histogram bucket bounds, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+STAGE_METRIC = "echopal_stage_seconds"
+REQUEST_METRIC = "echopal_request_seconds"
+
+HELP = {
+    STAGE_METRIC: "Duration of one pipeline stage",
+    REQUEST_METRIC: "End-to-end duration of a traced request",
+    "echopal_requests_total": "Traced requests by outcome",
+    "echopal_retrieval_budget_total": "Retrieval stages that overran their latency budget or were skipped",
+    "echopal_llm_chunks_total": "Streamed LLM text chunks",
+    "echopal_llm_retries_total": "LLM calls retried after a transient error",
+}
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    return sorted_values[max(0, math.ceil(q / 100 * len(sorted_values)) - 1)]
+
+
+class _Histogram:
+    def __init__(self, samples=TELEMETRY_SAMPLES):
+        self.bucket_counts = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        # Recent observations only, so the admin view shows current percentiles rather than all-time ones
+        self.recent = deque(maxlen=samples)
+
+    def observe(self, value):
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                self.bucket_counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+        self.recent.append(value)
+
+    def summary(self):
+        recent = sorted(self.recent)
+        return {"count": self.count, "sum": round(self.sum, 6),
+                **{f"p{q}_ms": round(percentile(recent, q) * 1000, 2) if recent else None for q in (50, 95, 99)}}
+
+
+class Metrics:
+    """Thread-safe registry of counters, histograms and callback gauges, keyed by name + labels"""
+
+    def __init__(self, samples=TELEMETRY_SAMPLES):
+        self.samples = samples
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._gauges = {}
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = _Histogram(self.samples)
+            histogram.observe(value)
+
+    def register_gauge(self, name, fn, help="", kind="gauge"):
+        """fn() returns a number or [(labels dict, number)]; it is called at export time. kind: gauge | counter"""
+        with self._lock:
+            self._gauges[name] = (fn, help, kind)
+
+    def _read_gauges(self):
+        with self._lock:
+            gauges = dict(self._gauges)
+        values = {}
+        for name, (fn, help, kind) in gauges.items():
+            try:
+                result = fn()
+            except Exception:
+                continue  # e.g. the index is still loading
+            rows = [({}, result)] if isinstance(result, (int, float)) else list(result)
+            values[name] = (rows, help, kind)
+        return values
+
+    def snapshot(self):
+        """All metrics as a JSON-serialisable dict (histograms summarised as count / sum / recent percentiles)"""
+        with self._lock:
+            counters = [(name, dict(labels), value) for (name, labels), value in self._counters.items()]
+            histograms = [(name, dict(labels), histogram.summary()) for (name, labels), histogram in
+                          self._histograms.items()]
+        result = {"counters": {}, "histograms": {}, "gauges": {}}
+        for name, labels, value in counters:
+            result["counters"].setdefault(name, []).append({"labels": labels, "value": value})
+        for name, labels, summary in histograms:
+            result["histograms"].setdefault(name, []).append({"labels": labels, **summary})
+        for name, (rows, _, _) in self._read_gauges().items():
+            result["gauges"][name] = [{"labels": labels, "value": value} for labels, value in rows]
+        return result
+
+    def prometheus_text(self):
+        """Prometheus text exposition format (version 0.0.4)"""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, (list(h.bucket_counts), h.count, h.sum)) for key, h in self._histograms.items())
+        lines, described = [], set()
+
+        def describe(name, kind, help=""):
+            if name not in described:
+                described.add(name)
+                lines.append(f"# HELP {name} {help or HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in counters:
+            describe(name, "counter")
+            lines.append(f"{name}{_labels(labels)} {value}")
+        for (name, labels), (bucket_counts, count, total) in histograms:
+            describe(name, "histogram")
+            cumulative = 0
+            for bound, bucket_count in zip(LATENCY_BUCKETS, bucket_counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{_labels(labels + (('le', repr(bound)),))} {cumulative}")
+            lines.append(f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {count}")
+            lines.append(f"{name}_sum{_labels(labels)} {total}")
+            lines.append(f"{name}_count{_labels(labels)} {count}")
+        for name, (rows, help, kind) in sorted(self._read_gauges().items()):
+            describe(name, kind, help)
+            for labels, value in rows:
+                lines.append(f"{name}{_labels(tuple(sorted(labels.items())))} {value}")
+        return "\n".join(lines) + "\n"
+
+    def stage_percentiles(self, name=STAGE_METRIC, label="stage"):
+        """{label value: {"count", "p50_ms", "p95_ms", "p99_ms"}} for one histogram family"""
+        with self._lock:
+            return {dict(labels).get(label, ""): histogram.summary()
+                    for (metric, labels), histogram in self._histograms.items() if metric == name}
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+
+def _labels(pairs):
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + "}"
+
+
+# --- Tracing ---
+class Trace:
+    def __init__(self, name, attrs):
+        self.id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.attrs = dict(attrs)
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        self.spans = []
+        self.duration_s = None
+
+    def add_span(self, name, seconds, started=None, **attrs):
+        offset = (started if started is not None else time.perf_counter() - seconds) - self.started
+        self.spans.append({"name": name, "offset_ms": round(offset * 1000, 2),
+                           "duration_ms": round(seconds * 1000, 2), **attrs})
+
+    def to_dict(self):
+        return {"trace_id": self.id, "name": self.name,
+                "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started_at)),
+                "duration_ms": round(self.duration_s * 1000, 2) if self.duration_s is not None else None,
+                "attrs": self.attrs, "spans": self.spans}
+
+
+_current_trace = contextvars.ContextVar("echopal_trace", default=None)
+_metrics = Metrics()
+_recent_traces = deque(maxlen=50)
+_log_lock = threading.Lock()
+
+
+def get_metrics():
+    return _metrics
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+def current_trace_id():
+    active = _current_trace.get()
+    return active.id if active else None
+
+
+@contextmanager
+def trace(name, **attrs):
+    """Run a request under a new trace; set t.attrs["outcome"] to count it by outcome"""
+    active = Trace(name, attrs)
+    token = _current_trace.set(active)
+    try:
+        yield active
+    except BaseException as e:
+        # Streamlit stops a script run with a BaseException when the user sends another message
+        active.attrs["outcome"] = "error" if isinstance(e, Exception) else "interrupted"
+        active.attrs["error"] = type(e).__name__
+        raise
+    finally:
+        _current_trace.reset(token)
+        active.duration_s = time.perf_counter() - active.started
+        _metrics.observe(REQUEST_METRIC, active.duration_s, pipeline=name)
+        _metrics.inc("echopal_requests_total", pipeline=name, outcome=active.attrs.get("outcome", "ok"))
+        _recent_traces.append(active.to_dict())
+        _log_trace(active)
+
+
+@contextmanager
+def span(name, **attrs):
+    """Time a block as pipeline stage `name` (recorded in the current trace, if any, and the stage histogram)"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, time.perf_counter() - started, started=started, **attrs)
+
+
+def record_span(name, seconds, started=None, **attrs):
+    """Record a stage duration that was measured elsewhere (e.g. time to first token)"""
+    _metrics.observe(STAGE_METRIC, seconds, stage=name)
+    active = _current_trace.get()
+    if active is not None:
+        active.add_span(name, seconds, started=started, **attrs)
+
+
+def annotate(**attrs):
+    """Attach details to the current trace (shown in the admin view and the JSON log); no-op outside a trace"""
+    active = _current_trace.get()
+    if active is not None:
+        active.attrs.update(attrs)
+
+
+def inc(name, value=1, **labels):
+    _metrics.inc(name, value, **labels)
+
+
+def recent_traces(limit=20):
+    """Most recent finished traces, newest first"""
+    return list(_recent_traces)[::-1][:limit]
+
+
+def snapshot():
+    return {**_metrics.snapshot(), "recent_traces": recent_traces()}
+
+
+def _log_trace(active):
+    if not TELEMETRY_LOG:
+        return
+    line = json.dumps(active.to_dict(), default=str)
+    with _log_lock:
+        if TELEMETRY_LOG == "stdout":
+            print(line, file=sys.stdout, flush=True)
+        else:
+            with open(TELEMETRY_LOG, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+
+# --- Optional scrape endpoint ---
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        path = self.path.split("?", 1)[0].rstrip("/")
+        if path == "/metrics":
+            body, content_type = _metrics.prometheus_text().encode("utf-8"), "text/plain; version=0.0.4"
+        elif path == "/metrics.json":
+            body, content_type = json.dumps(snapshot(), default=str).encode("utf-8"), "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # scrapes every few seconds would flood the console
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(port=TELEMETRY_PORT, host="0.0.0.0"):
+    """Serve /metrics and /metrics.json from a daemon thread (once per process); port 0 disables it"""
+    global _server
+    with _server_lock:
+        if _server is not None or not port:
+            return _server
+        try:
+            _server = ThreadingHTTPServer((host, port), MetricsHandler)
+        except OSError as e:
+            print(f"⚠️ Metrics endpoint not started on port {port}: {e}")
+            return None
+        _server.daemon_threads = True
+        threading.Thread(target=_server.serve_forever, name="echopal-metrics", daemon=True).start()
+        print(f"📈 Metrics on http://{host}:{port}/metrics")
+        return _server
@@ -0,0 +1,434 @@
+# vector_store.py = storage backends behind EmbeddingManager. "chroma" is the persistent ChromaDB collection EchoPal has
+# always used; "numpy" is an in-process index for corpora small enough to scan exhaustively (tens of thousands of
+# chunks): unit vectors in memory-mapped segment files, searched with one matrix product and a top-k selection.
+# Both speak the same small interface (count / upsert / update_metadata / delete / delete_source / query / get).
+
+import json
+import os
+import threading
+
+import numpy as np
+
+from config import VECTOR_BACKEND, VECTOR_DTYPE, VECTOR_MAX_SEGMENTS, VECTOR_COMPACT_RATIO
+
+
+class EmbeddingModelMismatchError(RuntimeError):
+    """The collection on disk was built with a different embedding model than the one configured"""
+
+
+def _check_model(name, metadata, model_info):
+    if (metadata.get("embedding_model") != model_info["embedding_model"]
+            or int(metadata.get("embedding_dim", 0)) != model_info["embedding_dim"]):
+        raise EmbeddingModelMismatchError(
+            f"Collection '{name}' was built with {metadata.get('embedding_model')} "
+            f"({metadata.get('embedding_dim')} dims) but the configured model is "
+            f"{model_info['embedding_model']} ({model_info['embedding_dim']} dims). "
+            "Re-index the knowledge base or change ECHOPAL_EMBEDDING_MODEL."
+        )
+
+
+class ChromaStore:
+    """The persistent ChromaDB collection (SQLite + HNSW)"""
+
+    backend = "chroma"
+
+    def __init__(self, persist_path, name, model_info):
+        # Imported here so the numpy backend works without loading Chroma
+        import chromadb
+        from chromadb.errors import NotFoundError
+
+        # Initialize persistent ChromaDB storage with ABSOLUTE path
+        self.client = chromadb.PersistentClient(path=persist_path)
+        try:
+            # embedding_function=None: we always pass precomputed vectors, so Chroma never loads its own model
+            self.collection = self.client.get_collection(name=name, embedding_function=None)
+        except NotFoundError:
+            self.collection = self.client.create_collection(name=name, metadata=model_info, embedding_function=None)
+            return
+
+        metadata = self.collection.metadata or {}
+        if "embedding_model" not in metadata:
+            # Collections from before this check were embedded by Chroma's default all-MiniLM-L6-v2
+            if self.collection.count() and model_info["embedding_model"] != "all-MiniLM-L6-v2":
+                raise EmbeddingModelMismatchError(
+                    f"Collection '{name}' was built with all-MiniLM-L6-v2 but the configured model is "
+                    f"'{model_info['embedding_model']}'. Re-index the knowledge base or change ECHOPAL_EMBEDDING_MODEL."
+                )
+            kept = {k: v for k, v in metadata.items() if not k.startswith("hnsw:")}
+            self.collection.modify(metadata={**kept, **model_info})
+            print(f"🏷️ Tagged collection '{name}' with embedding model {model_info['embedding_model']}.")
+            return
+        _check_model(name, metadata, model_info)
+
+    def count(self):
+        return self.collection.count()
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        self.collection.upsert(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+
+    def update_metadata(self, ids, metadatas):
+        """Merge the given keys into existing rows' metadata"""
+        self.collection.update(ids=ids, metadatas=metadatas)
+
+    def delete(self, ids):
+        self.collection.delete(ids=ids)
+
+    def delete_source(self, source):
+        self.collection.delete(where={"source": source})
+
+    def query(self, query_embeddings, top_k):
+        """Nearest rows per query as [(id, document, metadata, squared L2 distance)], best first"""
+        results = self.collection.query(
+            query_embeddings=[np.asarray(e, dtype=np.float32).tolist() for e in query_embeddings],
+            n_results=top_k,
+            include=["documents", "metadatas", "distances"]
+        )
+        return [list(zip(*rows)) for rows in zip(results["ids"], results["documents"],
+                                                  results["metadatas"], results["distances"])]
+
+    def get(self, ids=None, include=("documents", "metadatas"), limit=None, offset=None):
+        """Rows by id (or all rows, paged) as {"ids": [...], <include>: [...]}"""
+        return self.collection.get(ids=ids, include=list(include), limit=limit, offset=offset)
+
+    def persist(self):
+        """PersistentClient writes through; nothing to flush"""
+
+
+class _Segment:
+    """One immutable block of vectors (memory-mapped read-only, shared through the OS page cache) + its rows"""
+
+    def __init__(self, folder, spec, dim, dtype):
+        self.name = spec["name"]
+        self.table_version = spec["table"]
+        rows = spec["rows"]
+        vec_path = os.path.join(folder, f"{self.name}.vec")
+        self.vectors = (np.memmap(vec_path, dtype=dtype, mode="r", shape=(rows, dim))
+                        if rows else np.empty((0, dim), dtype=dtype))
+        self.scales = None
+        if dtype == np.int8 and rows:
+            self.scales = np.memmap(os.path.join(folder, f"{self.name}.scale"), dtype=np.float32, mode="r",
+                                    shape=(rows,))
+        with open(os.path.join(folder, f"{self.name}.{self.table_version}.json"), "r", encoding="utf-8") as f:
+            table = json.load(f)
+        self.ids, self.documents, self.metadatas = table["ids"], table["documents"], table["metadatas"]
+        self.alive = np.ones(rows, dtype=bool)
+        self.alive[spec["deleted"]] = False
+
+    def __len__(self):
+        return len(self.ids)
+
+    def block(self, start, stop):
+        """Rows start:stop as float32 (dequantized for int8 segments)"""
+        block = self.vectors[start:stop]
+        if self.scales is None:
+            return block
+        return block.astype(np.float32) * self.scales[start:stop, None]
+
+
+class NumpyStore:
+    """Exhaustive in-memory search over memory-mapped segments.
+
+    Writes append a new immutable segment; deletes and overwrites only mark rows dead. Segments are merged and dead
+    rows dropped ("compaction") once there are too many segments or too many dead rows. The manifest is swapped
+    atomically and re-read when it changes, so other processes (ingest CLI, worker pools) can map the same files.
+    """
+
+    backend = "numpy"
+    BLOCK_ROWS = 8192  # rows scored per matrix product; bounds the float32 copy made for int8 segments
+
+    def __init__(self, persist_path, name, model_info, dtype=VECTOR_DTYPE,
+                 max_segments=VECTOR_MAX_SEGMENTS, compact_ratio=VECTOR_COMPACT_RATIO):
+        self.folder = os.path.join(persist_path, "numpy_store", name)
+        self.manifest_path = os.path.join(self.folder, "manifest.json")
+        self.max_segments = max_segments
+        self.compact_ratio = compact_ratio
+        self._lock = threading.RLock()
+        self._mtime = None
+        os.makedirs(self.folder, exist_ok=True)
+
+        if not os.path.exists(self.manifest_path):
+            if dtype not in ("float32", "int8"):
+                raise ValueError(f"Unsupported vector dtype '{dtype}' (use float32 or int8)")
+            self._manifest = {"format": 1, "dtype": dtype, "metadata": dict(model_info),
+                              "segments": [], "next_segment": 1}
+            self._segments, self._where = [], {}
+            self._save_manifest()
+        self._reload_if_changed()
+        _check_model(name, self._manifest["metadata"], model_info)
+        if self._manifest["dtype"] != dtype:
+            print(f"⚠️ {name} is stored as {self._manifest['dtype']}; ECHOPAL_VECTOR_DTYPE={dtype} applies to new stores.")
+        self.dim = model_info["embedding_dim"]
+        self.dtype = np.dtype(self._manifest["dtype"])
+
+    # --- Reads ---
+    def count(self):
+        self._reload_if_changed()
+        return len(self._where)
+
+    def query(self, query_embeddings, top_k):
+        """Nearest rows per query as [(id, document, metadata, squared L2 distance)], best first"""
+        self._reload_if_changed()
+        queries = np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32))
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        with self._lock:
+            segments = list(self._segments)
+
+        # Best top_k of every block, merged at the end: (n_queries, candidates) scores and (segment, row) refs
+        best_scores, best_refs = [], []
+        for seg_index, segment in enumerate(segments):
+            for start in range(0, len(segment), self.BLOCK_ROWS):
+                stop = min(start + self.BLOCK_ROWS, len(segment))
+                scores = queries @ segment.block(start, stop).T
+                scores[:, ~segment.alive[start:stop]] = -np.inf
+                k = min(top_k, stop - start)
+                top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                best_scores.append(np.take_along_axis(scores, top, axis=1))
+                best_refs.append(np.stack([np.full_like(top, seg_index), top + start], axis=-1))
+
+        if not best_scores:
+            return [[] for _ in queries]
+        scores = np.concatenate(best_scores, axis=1)
+        refs = np.concatenate(best_refs, axis=1)
+        results = []
+        for q in range(len(queries)):
+            order = np.argsort(-scores[q])[:top_k]
+            rows = []
+            for i in order:
+                if not np.isfinite(scores[q, i]):
+                    break
+                segment, row = segments[refs[q, i, 0]], int(refs[q, i, 1])
+                # Same convention as Chroma's "l2" space: squared L2 of unit vectors = 2 - 2 * cosine
+                distance = max(0.0, 2.0 - 2.0 * float(scores[q, i]))
+                rows.append((segment.ids[row], segment.documents[row], dict(segment.metadatas[row]), distance))
+            results.append(rows)
+        return results
+
+    def get(self, ids=None, include=("documents", "metadatas"), limit=None, offset=None):
+        """Rows by id (or all live rows, paged) as {"ids": [...], <include>: [...]}"""
+        self._reload_if_changed()
+        with self._lock:
+            if ids is not None:
+                refs = [self._where[i] for i in ids if i in self._where]
+            else:
+                refs = [(s, r) for s, segment in enumerate(self._segments) for r in np.flatnonzero(segment.alive)]
+                refs = refs[offset or 0:None if limit is None else (offset or 0) + limit]
+            segments = self._segments
+            result = {"ids": [segments[s].ids[r] for s, r in refs]}
+            if "documents" in include:
+                result["documents"] = [segments[s].documents[r] for s, r in refs]
+            if "metadatas" in include:
+                result["metadatas"] = [dict(segments[s].metadatas[r]) for s, r in refs]
+            if "embeddings" in include:
+                result["embeddings"] = [np.array(segments[s].block(r, r + 1)[0], dtype=np.float32) for s, r in refs]
+        return result
+
+    # --- Writes ---
+    def upsert(self, ids, embeddings, documents, metadatas):
+        # Last occurrence wins, as with repeated ids in one Chroma upsert
+        last = {chunk_id: i for i, chunk_id in enumerate(ids)}
+        keep = sorted(last.values())
+        vectors = np.asarray(embeddings, dtype=np.float32)[keep]
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        with self._lock:
+            self._reload_if_changed()
+            name = f"seg-{self._manifest['next_segment']:06d}"
+            self._write_segment(name, vectors, [ids[i] for i in keep], [documents[i] for i in keep],
+                                [metadatas[i] for i in keep])
+            self._manifest["next_segment"] += 1
+            self._tombstone([ids[i] for i in keep])
+            self._manifest["segments"].append({"name": name, "rows": len(keep), "table": 1, "deleted": []})
+            self._commit()
+
+    def update_metadata(self, ids, metadatas):
+        """Merge the given keys into existing rows' metadata (rewrites only the touched segments' tables)"""
+        with self._lock:
+            self._reload_if_changed()
+            touched = set()
+            for chunk_id, metadata in zip(ids, metadatas):
+                if chunk_id in self._where:
+                    s, r = self._where[chunk_id]
+                    self._segments[s].metadatas[r] = {**self._segments[s].metadatas[r], **metadata}
+                    touched.add(s)
+            for s in touched:
+                spec, segment = self._manifest["segments"][s], self._segments[s]
+                spec["table"] += 1
+                segment.table_version = spec["table"]
+                self._write_table(spec["name"], spec["table"], segment.ids, segment.documents, segment.metadatas)
+            if touched:
+                self._commit()
+
+    def delete(self, ids):
+        with self._lock:
+            self._reload_if_changed()
+            if self._tombstone(ids):
+                self._commit()
+
+    def delete_source(self, source):
+        with self._lock:
+            self._reload_if_changed()
+            ids = [chunk_id for chunk_id, (s, r) in self._where.items()
+                   if self._segments[s].metadatas[r].get("source") == source]
+            if self._tombstone(ids):
+                self._commit()
+
+    def persist(self):
+        """Every write is already on disk; merge segments and drop dead rows now"""
+        with self._lock:
+            self._reload_if_changed()
+            self.compact()
+
+    def compact(self):
+        """Rewrite all live rows into one segment, then remove the old segment files"""
+        with self._lock:
+            live = [(segment, np.flatnonzero(segment.alive)) for segment in self._segments]
+            total = sum(len(rows) for _, rows in live)
+            if len(self._segments) <= 1 and total == sum(len(s) for s in self._segments):
+                return
+            name = f"seg-{self._manifest['next_segment']:06d}"
+            vectors = np.memmap(os.path.join(self.folder, f"{name}.vec"), dtype=self.dtype, mode="w+",
+                                shape=(total, self.dim)) if total else None
+            scales = np.empty(total, dtype=np.float32) if self.dtype == np.int8 else None
+            ids, documents, metadatas, offset = [], [], [], 0
+            for segment, rows in live:
+                for start in range(0, len(rows), self.BLOCK_ROWS):
+                    chunk = rows[start:start + self.BLOCK_ROWS]
+                    # Copy raw (possibly quantized) rows so int8 vectors are never re-quantized
+                    vectors[offset:offset + len(chunk)] = segment.vectors[chunk]
+                    if scales is not None:
+                        scales[offset:offset + len(chunk)] = segment.scales[chunk]
+                    offset += len(chunk)
+                ids.extend(segment.ids[r] for r in rows)
+                documents.extend(segment.documents[r] for r in rows)
+                metadatas.extend(segment.metadatas[r] for r in rows)
+            if vectors is not None:
+                vectors.flush()
+                del vectors
+            if scales is not None:
+                scales.tofile(os.path.join(self.folder, f"{name}.scale"))
+            self._write_table(name, 1, ids, documents, metadatas)
+
+            merged = len(self._manifest["segments"])
+            self._manifest["next_segment"] += 1
+            self._manifest["segments"] = [{"name": name, "rows": total, "table": 1, "deleted": []}]
+            # Drop our maps of the old segments before their files are removed
+            del live
+            self._segments = []
+            self._save_manifest()
+            self._load_segments()
+            print(f"🗜️ Compacted vector store: {merged} segments -> 1 ({total} rows).")
+
+    # --- internals ---
+    def _reload_if_changed(self):
+        """Pick up segments written by other processes with one stat() call"""
+        try:
+            mtime = os.path.getmtime(self.manifest_path)
+        except OSError:
+            return
+        with self._lock:
+            if mtime == self._mtime:
+                return
+            for attempt in range(3):
+                with open(self.manifest_path, "r", encoding="utf-8") as f:
+                    self._manifest = json.load(f)
+                try:
+                    self._load_segments()
+                    break
+                except FileNotFoundError:
+                    # A writer replaced a table or compacted between our manifest read and the file open; re-read
+                    if attempt == 2:
+                        raise
+            self._mtime = mtime
+
+    def _load_segments(self):
+        dtype = np.dtype(self._manifest["dtype"])
+        dim = int(self._manifest["metadata"]["embedding_dim"])
+        cached = {(s.name, s.table_version): s for s in getattr(self, "_segments", [])}
+        segments = []
+        for spec in self._manifest["segments"]:
+            segment = cached.get((spec["name"], spec["table"]))
+            if segment is None:
+                segment = _Segment(self.folder, spec, dim, dtype)
+            else:
+                # Swap in a new mask rather than editing the one a concurrent query may be reading
+                alive = np.ones(spec["rows"], dtype=bool)
+                alive[spec["deleted"]] = False
+                segment.alive = alive
+            segments.append(segment)
+        self._segments = segments
+        self._where = {segment.ids[r]: (s, int(r))
+                       for s, segment in enumerate(segments) for r in np.flatnonzero(segment.alive)}
+
+    def _tombstone(self, ids):
+        """Mark live rows dead; returns how many were"""
+        dead = 0
+        for chunk_id in ids:
+            ref = self._where.pop(chunk_id, None)
+            if ref is not None:
+                s, r = ref
+                self._segments[s].alive[r] = False
+                self._manifest["segments"][s]["deleted"].append(r)
+                dead += 1
+        return dead
+
+    def _commit(self):
+        """Persist the manifest, compacting instead when segments or dead rows pile up"""
+        self._load_segments()
+        total = sum(spec["rows"] for spec in self._manifest["segments"])
+        dead = sum(len(spec["deleted"]) for spec in self._manifest["segments"])
+        if len(self._manifest["segments"]) > self.max_segments or (total and dead / total > self.compact_ratio):
+            self.compact()
+        else:
+            self._save_manifest()
+
+    def _write_segment(self, name, vectors, ids, documents, metadatas):
+        if self.dtype == np.int8:
+            # Symmetric per-row quantization: 4x smaller, scores within ~1% of float32
+            scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127.0
+            vectors = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+            scales.astype(np.float32).tofile(os.path.join(self.folder, f"{name}.scale"))
+        vectors.astype(self.dtype, copy=False).tofile(os.path.join(self.folder, f"{name}.vec"))
+        self._write_table(name, 1, ids, documents, metadatas)
+
+    def _write_table(self, name, version, ids, documents, metadatas):
+        path = os.path.join(self.folder, f"{name}.{version}.json")
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"ids": ids, "documents": documents, "metadatas": metadatas}, f, separators=(",", ":"))
+        os.replace(path + ".tmp", path)
+
+    def _save_manifest(self):
+        # Write to a temp file then swap, so readers never see a half-written manifest
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._manifest, f)
+        os.replace(tmp_path, self.manifest_path)
+        self._mtime = os.path.getmtime(self.manifest_path)
+        self._sweep()
+
+    def _sweep(self):
+        """Remove segment files and old table versions the manifest no longer references"""
+        tables = {spec["name"]: f"{spec['name']}.{spec['table']}.json" for spec in self._manifest["segments"]}
+        for file_name in os.listdir(self.folder):
+            segment = file_name.split(".", 1)[0]
+            # Only segments numbered below next_segment: anything newer is still being written
+            if not segment.startswith("seg-") or int(segment[4:]) >= self._manifest["next_segment"]:
+                continue
+            if segment not in tables or (file_name.endswith(".json") and file_name != tables[segment]):
+                try:
+                    os.remove(os.path.join(self.folder, file_name))
+                except OSError:
+                    # Still mapped by another process on Windows; a later write retries
+                    pass
+
+
+# Registered store backends, selected with ECHOPAL_VECTOR_BACKEND
+VECTOR_STORES = {
+    ChromaStore.backend: ChromaStore,
+    NumpyStore.backend: NumpyStore,
+}
+
+
+def open_vector_store(persist_path, name, model_info, backend=VECTOR_BACKEND):
+    """Open (or create) the configured store backend and check it was built with the configured encoder"""
+    if backend not in VECTOR_STORES:
+        raise ValueError(f"Unknown vector backend '{backend}'. Available: {', '.join(VECTOR_STORES)}")
+    return VECTOR_STORES[backend](persist_path, name, model_info)